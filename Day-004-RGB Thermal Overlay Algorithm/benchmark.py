@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""
+Reproducible benchmark for the RGB / Thermal alignment pipeline.
+
+Generates synthetic RGB/thermal pairs with a known scale, offset, noise level
+and edge content, runs them through process_single_pair for every search
+variant, and reports throughput, per-stage latency and alignment error
+against ground truth. Needs only OpenCV + NumPy (offline, plain CPU).
+
+    python benchmark.py                              # 640x512 + 1080p, all variants
+    python benchmark.py --sizes 640x512 7680x4320 --variants pyramid fourier
+    python benchmark.py --set SCALE_STEP=0.01 --set MEMORY_BOUNDED=True
+    python benchmark.py --rotation 0                 # skip the rotated (fourier-only) datasets
+    python benchmark.py --smoke --max-error 8        # checked-in input-images, CI gate
+    python benchmark.py --profile-check              # a perturbed rig profile must fall back to search
+"""
+import argparse
+import ast
+import json
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from task_1_code import (AlignmentEngine, Config, PairResult, PIPELINE_STAGES, calibrate,
+                         process_single_pair, stage_percentiles)
+
+INPUT_IMAGES = Path(__file__).parent / "input-images"
+THERMAL_SIZE = (640, 512)  # DJI H20T radiometric frame
+
+# Search backends / strategies compared by default
+VARIANTS: Dict[str, dict] = {
+    "exhaustive": {},
+    "pyramid": {"SEARCH_STRATEGY": "pyramid"},
+    "pyramid+reduced4": {"SEARCH_STRATEGY": "pyramid", "SEARCH_DECODE_REDUCTION": 4},
+    "golden": {"SEARCH_STRATEGY": "golden"},
+    "fourier": {"BACKEND": "fourier"},
+    "bounded": {"MEMORY_BOUNDED": True},
+}
+# Only these variants estimate rotation; rotated datasets are run with them alone
+ROTATION_VARIANTS = {name for name, overrides in VARIANTS.items() if overrides.get("BACKEND") == "fourier"}
+# Rig drift applied to a calibrated profile by --profile-check: (label, start shift in
+# fractions of the frame width, scale change); each must be caught by verification
+PROFILE_PERTURBATIONS = (("shift x 1.5%", 0.015, 0.0), ("shift x 3%", 0.03, 0.0), ("scale +0.02", 0.0, 0.02))
+
+
+# ----------------- SYNTHETIC DATA -----------------
+def make_scene(width: int, height: int, poles: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Grayscale scene with vertical poles (the structure the skeleton keys on) and blobs.
+    """
+    scene = np.full((height, width), 90, dtype=np.uint8)
+    unit = max(1, width // 640)
+    for _ in range(poles):
+        x = int(rng.integers(0, width))
+        w = int(rng.integers(2, 12)) * unit
+        top = int(rng.integers(0, height // 2))
+        scene[top:, x:x + w] = int(rng.integers(150, 256))
+    for _ in range(poles // 2):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(scene, center, int(rng.integers(5, 40)) * unit, int(rng.integers(0, 256)), -1)
+    return cv2.GaussianBlur(scene, (3, 3), 0)
+
+
+def make_synthetic_pair(width: int, height: int, scale: float, offset: Tuple[int, int],
+                        noise: float = 3.0, poles: int = 60, seed: int = 0, rotation: float = 0.0
+                        ) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """
+    RGB frame, raw thermal frame and the ground-truth best_result.
+    The thermal frame is the RGB scene seen through the pipeline's own
+    transform model (resize to RGB * scale, top-left at offset), blurred,
+    contrast-mapped and noised like a microbolometer image.
+    """
+    rng = np.random.default_rng(seed)
+    scene = make_scene(width, height, poles, rng)
+    rgb = cv2.merge([scene, (scene * 0.9).astype(np.uint8), scene])
+
+    truth = {"score": 1.0, "scale": scale, "rotation": rotation, "loc": offset, "offset": (0, 0)}
+    thermal_shape = (THERMAL_SIZE[1], THERMAL_SIZE[0])
+    matrix = AlignmentEngine.alignment_matrix(truth, thermal_shape, rgb.shape)
+
+    thermal = cv2.warpAffine(scene, matrix, THERMAL_SIZE, flags=cv2.INTER_AREA | cv2.WARP_INVERSE_MAP,
+                             borderMode=cv2.BORDER_REFLECT)
+    thermal = cv2.GaussianBlur(thermal, (3, 3), 0)
+    thermal = np.clip(255.0 * (thermal / 255.0) ** 0.8 + rng.normal(0, noise, thermal.shape), 0, 255)
+    return rgb, thermal.astype(np.uint8), truth
+
+
+def smoke_pair(thermal: np.ndarray, scale: float, offset: Tuple[int, int], seed: int
+               ) -> Tuple[np.ndarray, dict]:
+    """
+    RGB counterpart for a real thermal frame: the thermal content placed on a
+    4x canvas with a known transform (reflected beyond the footprint).
+    """
+    rng = np.random.default_rng(seed)
+    h_t, w_t = thermal.shape[:2]
+    width, height = w_t * 4, h_t * 4
+    truth = {"score": 1.0, "scale": scale, "rotation": 0.0, "loc": offset, "offset": (0, 0)}
+    matrix = AlignmentEngine.alignment_matrix(truth, thermal.shape, (height, width))
+
+    canvas = cv2.warpAffine(thermal, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+    canvas = np.clip(canvas + rng.normal(0, 2.0, canvas.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR), truth
+
+
+def random_truth(width: int, rng: np.random.Generator) -> Tuple[float, Tuple[int, int]]:
+    scale = float(rng.uniform(0.92, 1.08))
+    reach = int(0.03 * width)
+    return scale, (int(rng.integers(-reach, reach + 1)), int(rng.integers(-reach, reach + 1)))
+
+
+# ----------------- METRICS -----------------
+def alignment_error(result: PairResult, truth: dict, thermal_shape: Tuple[int, ...],
+                    rgb_shape: Tuple[int, ...]) -> Optional[float]:
+    """
+    Mean displacement (RGB px) of the four thermal corners between the
+    estimated and the true transform.
+    """
+    if result.status != "OK" or result.offset is None:
+        return None
+    estimate = {"scale": result.scale, "rotation": result.rotation, "loc": tuple(result.offset), "offset": (0, 0)}
+
+    h, w = thermal_shape[:2]
+    corners = np.array([[0, 0, 1], [w, 0, 1], [0, h, 1], [w, h, 1]], dtype=np.float64).T
+    est = AlignmentEngine.alignment_matrix(estimate, thermal_shape, rgb_shape) @ corners
+    ref = AlignmentEngine.alignment_matrix(truth, thermal_shape, rgb_shape) @ corners
+    return float(np.mean(np.linalg.norm(est - ref, axis=0)))
+
+
+# ----------------- RUNNER -----------------
+def write_pairs(pairs: List[Tuple[str, np.ndarray, np.ndarray, Optional[dict]]], directory: Path) -> None:
+    for name, rgb, thermal, _ in pairs:
+        cv2.imwrite(str(directory / f"{name}_Z.JPG"), rgb, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        cv2.imwrite(str(directory / f"{name}_T.JPG"), thermal, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+
+def run_variant(pairs: list, directory: Path, config: Config) -> dict:
+    """
+    Runs every pair in-process (one worker, like a pool process would) and summarises.
+    """
+    results: List[PairResult] = []
+    errors: List[float] = []
+
+    start = time.perf_counter()
+    for name, rgb, thermal, truth in pairs:
+        result = process_single_pair(directory / f"{name}_Z.JPG", config)
+        results.append(result)
+        if truth is not None:
+            error = alignment_error(result, truth, thermal.shape, rgb.shape)
+            if error is not None:
+                errors.append(error)
+    elapsed = time.perf_counter() - start
+
+    ok = [res for res in results if res.status == "OK"]
+    return {
+        "pairs": len(pairs),
+        "ok": len(ok),
+        "pairs_per_sec": len(pairs) / elapsed if elapsed > 0 else 0.0,
+        "mean_error_px": float(np.mean(errors)) if errors else None,
+        "max_error_px": float(np.max(errors)) if errors else None,
+        "mean_score": float(np.mean([res.score for res in ok])) if ok else None,
+        "stages": stage_percentiles(ok),
+        "failures": [str(res) for res in results if res.status != "OK"],
+    }
+
+
+def build_datasets(args: argparse.Namespace) -> Dict[str, list]:
+    """
+    Dataset label -> [(name, rgb, thermal, truth or None)].
+    """
+    rng = np.random.default_rng(args.seed)
+    datasets: Dict[str, list] = {}
+
+    if args.smoke:
+        pairs = []
+        for i, thermal_path in enumerate(sorted(INPUT_IMAGES.glob("*_T.JPG"))):
+            thermal = cv2.imread(str(thermal_path), cv2.IMREAD_GRAYSCALE)
+            if thermal is None:
+                continue
+            name = thermal_path.name.replace("_T.JPG", "")
+            rgb_path = thermal_path.parent / f"{name}_Z.JPG"
+            if rgb_path.exists():
+                # Real pair: no ground truth, latency and score only
+                pairs.append((name, cv2.imread(str(rgb_path)), thermal, None))
+            else:
+                scale, offset = random_truth(thermal.shape[1] * 4, rng)
+                rgb, truth = smoke_pair(thermal, scale, offset, seed=args.seed + i)
+                pairs.append((name, rgb, thermal, truth))
+        datasets["smoke"] = pairs
+        return datasets
+
+    for size in args.sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        pairs = []
+        for i in range(args.pairs):
+            scale, offset = random_truth(width, rng)
+            rgb, thermal, truth = make_synthetic_pair(width, height, scale, offset, noise=args.noise,
+                                                      poles=args.poles, seed=args.seed + i)
+            pairs.append((f"S{i:03d}", rgb, thermal, truth))
+        datasets[f"{width}x{height}"] = pairs
+
+        # Same frame size with a small rig rotation (+/- args.rotation degrees)
+        if args.rotation:
+            pairs = []
+            for i in range(args.pairs):
+                scale, offset = random_truth(width, rng)
+                rotation = float(rng.uniform(-args.rotation, args.rotation))
+                rgb, thermal, truth = make_synthetic_pair(width, height, scale, offset, noise=args.noise,
+                                                          poles=args.poles, seed=args.seed + i, rotation=rotation)
+                pairs.append((f"R{i:03d}", rgb, thermal, truth))
+            datasets[f"{width}x{height}r{args.rotation:g}"] = pairs
+    return datasets
+
+
+def profile_check(args: argparse.Namespace, overrides: dict) -> int:
+    """
+    Calibrates a profile on pairs from one synthetic rig, then runs every pair
+    with that profile and with PROFILE_PERTURBATIONS of it. Exit 1 if a
+    perturbed profile is ever used instead of falling back to the search.
+    """
+    width, height = (int(v) for v in args.sizes[0].lower().split("x"))
+    rng = np.random.default_rng(args.seed)
+    scale, offset = random_truth(width, rng)
+    pairs = []
+    for i in range(max(args.pairs, 4)):
+        rgb, thermal, truth = make_synthetic_pair(width, height, scale, offset, noise=args.noise,
+                                                  poles=args.poles, seed=args.seed + i)
+        pairs.append((f"P{i:03d}", rgb, thermal, truth))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp) / "pairs"
+        directory.mkdir()
+        write_pairs(pairs, directory)
+        rgb_files = [directory / f"{name}_Z.JPG" for name, *_ in pairs]
+        config = replace(Config(), INPUT_DIR=directory, OUTPUT_DIR=Path(tmp) / "out", ASYNC_WRITE=False,
+                         MANIFEST=False, MAX_WORKERS=1, **overrides)
+        (config.OUTPUT_DIR / "output").mkdir(parents=True, exist_ok=True)
+
+        profile_path = Path(tmp) / "profile.json"
+        cameras = calibrate(rgb_files, config, profile_path)
+        if not cameras:
+            print("Calibration produced no profile")
+            return 1
+        (key, fitted), = cameras.items()
+        print(f"{width}x{height}: scale={fitted['scale']:.3f} start={fitted['start']} "
+              f"verify_score={fitted['verify_score']:.3f}")
+
+        failed = False
+        for label, shift, scale_change in (("intact", 0.0, 0.0),) + PROFILE_PERTURBATIONS:
+            profile = dict(fitted, scale=fitted["scale"] + scale_change,
+                           start=[fitted["start"][0] + int(round(shift * width)), fitted["start"][1]])
+            path = Path(tmp) / f"{label.replace(' ', '_')}.json"
+            path.write_text(json.dumps({"version": 1, "cameras": {key: profile}}), encoding="utf-8")
+
+            results = [process_single_pair(file, replace(config, PROFILE_PATH=path)) for file in rgb_files]
+            used = sum(res.source == "profile" for res in results)
+            print(f"  {label:<14} profile used on {used}/{len(results)} pair(s)")
+            if label != "intact" and used:
+                failed = True
+    return 1 if failed else 0
+
+
+def parse_overrides(items: List[str]) -> dict:
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        if key not in Config.__dataclass_fields__:
+            raise SystemExit(f"Unknown Config field: {key}")
+        try:
+            overrides[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[key] = value
+    return overrides
+
+
+def print_report(dataset: str, variant: str, summary: dict) -> None:
+    def fmt(value: Optional[float], spec: str = "7.2f") -> str:
+        return format(value, spec) if value is not None else "    n/a"
+
+    stages = summary["stages"]
+    p50 = "  ".join(f"{name}={stages[name][0]:.3f}" for name in PIPELINE_STAGES + ("total",) if name in stages)
+    print(f"{dataset:<11} {variant:<18} {summary['pairs_per_sec']:7.2f} "
+          f"{fmt(summary['mean_error_px'])} {fmt(summary['max_error_px'])} {fmt(summary['mean_score'], '6.3f')}  {p50}")
+    for failure in summary["failures"]:
+        print(f"    {failure}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the RGB / Thermal alignment pipeline")
+    parser.add_argument("--sizes", nargs="+", default=["640x512", "1920x1080"],
+                        help="RGB frame sizes, e.g. 640x512 4056x3040 7680x4320")
+    parser.add_argument("--pairs", type=int, default=3, help="Synthetic pairs per size")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Config override applied to every variant (repeatable)")
+    parser.add_argument("--noise", type=float, default=3.0, help="Thermal noise sigma")
+    parser.add_argument("--poles", type=int, default=60, help="Edge content: vertical structures per frame")
+    parser.add_argument("--rotation", type=float, default=3.0,
+                        help="Also build a dataset per size rotated by up to +/- this many degrees (0 = off)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--smoke", action="store_true", help="Use the checked-in input-images instead")
+    parser.add_argument("--json", type=Path, help="Write the full report as JSON")
+    parser.add_argument("--max-error", type=float,
+                        help="Exit 1 if any variant's mean error exceeds this many px (CI gate)")
+    parser.add_argument("--profile-check", action="store_true",
+                        help="Exit 1 if a perturbed calibration profile is accepted without a search")
+    args = parser.parse_args()
+
+    overrides = parse_overrides(args.set)
+    if args.profile_check:
+        return profile_check(args, overrides)
+    datasets = build_datasets(args)
+    report = {}
+    failed = False
+
+    print(f"{'dataset':<11} {'variant':<18} {'pairs/s':>7} {'err_px':>7} {'max_px':>7} {'score':>6}  p50 stage latency (s)")
+    print("-" * 110)
+    with tempfile.TemporaryDirectory() as tmp:
+        for dataset, pairs in datasets.items():
+            directory = Path(tmp) / dataset
+            directory.mkdir()
+            write_pairs(pairs, directory)
+            rotated = any(truth is not None and truth["rotation"] for *_, truth in pairs)
+
+            for variant in args.variants:
+                if rotated and variant not in ROTATION_VARIANTS:
+                    continue
+                config = replace(Config(), INPUT_DIR=directory, OUTPUT_DIR=Path(tmp) / "out",
+                                 ASYNC_WRITE=False, MANIFEST=False, MAX_WORKERS=1, **VARIANTS[variant], **overrides)
+                (config.OUTPUT_DIR / "output").mkdir(parents=True, exist_ok=True)
+
+                summary = run_variant(pairs, directory, config)
+                report.setdefault(dataset, {})[variant] = summary
+                print_report(dataset, variant, summary)
+
+                error = summary["mean_error_px"]
+                if args.max_error is not None and (summary["ok"] < summary["pairs"] or
+                                                   (error is not None and error > args.max_error)):
+                    failed = True
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nReport written to {args.json}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
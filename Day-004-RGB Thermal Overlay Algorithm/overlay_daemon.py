@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+"""
+Long-running overlay service with a warm worker pool.
+
+Start-up cost (interpreter, cv2/numpy imports, process spawn) is paid once;
+jobs are then submitted over local HTTP with their own input/output paths
+and Config overrides, and run through the same run_batch as the CLI.
+Overlays are written synchronously inside the workers (ASYNC_WRITE is off),
+so a finished job means every OK pair's files are on disk.
+
+    python overlay_daemon.py --port 8765 --workers 4
+
+    POST /jobs        {"input_dir": "...", "output_dir": "...",
+                       "files": ["..._Z.JPG"],              (optional, default: all pairs in input_dir)
+                       "config": {"BLEND_MODE": "hot"}}     (optional Config overrides)
+                      -> {"id": "..."}
+    GET  /jobs/<id>   job state, progress and (once finished) per-pair results
+    GET  /jobs        all jobs, without results (the last FINISHED_JOBS finished ones)
+    GET  /metrics     uptime, pool size, job / pair counters, stage percentiles
+    GET  /health
+    POST /shutdown
+
+LocalClient talks to an in-process OverlayService with the same calls as
+HttpClient, for tests and tools that do not need the socket.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from task_1_code import (AlignmentEngine, Config, PairResult, init_worker, logger, metrics_path,
+                         plan_execution, run_batch, stage_percentiles, write_metrics)
+
+RECENT_RESULTS = 1000  # Pair results kept for the /metrics stage percentiles
+FINISHED_JOBS = 200    # Done / failed jobs kept for GET /jobs; older ones are dropped
+PATH_FIELDS = {"INPUT_DIR", "OUTPUT_DIR", "PROFILE_PATH", "METRICS_PATH", "MANIFEST_PATH"}
+# Fixed by the warm pool, not per job. Writes are synchronous in the daemon: a
+# pooled worker's background writer outlives the job, so "done" would not mean
+# the files exist, and its write errors would never reach the PairResult.
+POOL_FIELDS = {"MAX_WORKERS", "CV_THREADS", "ASYNC_WRITE"}
+
+
+def warm_worker(_: int) -> int:
+    """
+    Pays each worker's first-call costs (OpenCV dispatch, NumPy) before real jobs arrive.
+    """
+    AlignmentEngine.extract_skeleton(np.zeros((64, 64, 3), dtype=np.uint8))
+    return os.getpid()
+
+
+def apply_overrides(config: Config, overrides: Dict[str, object]) -> Config:
+    """
+    Config with JSON overrides applied (paths -> Path, lists -> tuples).
+    """
+    known = {f.name for f in fields(Config)}
+    unknown = set(overrides) - known
+    if unknown:
+        raise ValueError(f"Unknown Config field(s): {', '.join(sorted(unknown))}")
+    if set(overrides) & POOL_FIELDS:
+        raise ValueError(f"{', '.join(sorted(set(overrides) & POOL_FIELDS))} are fixed by the daemon's pool")
+
+    values = {}
+    for name, value in overrides.items():
+        if name in PATH_FIELDS and value is not None:
+            value = Path(value)
+        elif isinstance(value, list):
+            value = tuple(value)
+        values[name] = value
+    return replace(config, **values)
+
+
+# ================= JOBS =================
+class Job:
+    """
+    One submitted batch and its progress.
+    """
+
+    def __init__(self, config: Config, rgb_files: List[Path]):
+        self.id = uuid.uuid4().hex[:12]
+        self.config = config
+        self.rgb_files = rgb_files
+        self.state = "queued"   # "queued" | "running" | "done" | "failed"
+        self.error: Optional[str] = None
+        self.results: List[PairResult] = []
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def to_dict(self, with_results: bool = False) -> dict:
+        data = {
+            "id": self.id,
+            "state": self.state,
+            "input_dir": str(self.config.INPUT_DIR),
+            "output_dir": str(self.config.OUTPUT_DIR),
+            "pairs": len(self.rgb_files),
+            "completed": len(self.results),
+            "counts": dict(Counter(res.status for res in self.results)),
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "seconds": (self.finished or time.time()) - self.started if self.started else None,
+            "error": self.error
+        }
+        if with_results:
+            data["results"] = [asdict(res) for res in self.results]
+        return data
+
+
+class OverlayService:
+    """
+    Warm process pool + job queue. Pairs of all jobs share the pool;
+    DAEMON_JOBS jobs are fed into it side by side.
+    """
+
+    def __init__(self, config: Config):
+        self.config = replace(plan_execution(config, os.cpu_count() or 1), ASYNC_WRITE=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.config.MAX_WORKERS, initializer=init_worker,
+                                            initargs=(self.config.CV_THREADS,))
+        self.runner = ThreadPoolExecutor(max_workers=max(1, self.config.DAEMON_JOBS), thread_name_prefix="job")
+        self.jobs: Dict[str, Job] = {}
+        self.recent: deque = deque(maxlen=RECENT_RESULTS)
+        self.pair_counts: Counter = Counter()
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+        # Spawn and warm every worker now, not on the first job
+        pids = set(self.executor.map(warm_worker, range(self.config.MAX_WORKERS)))
+        logger.info(f"Warm pool ready: {len(pids)} worker process(es)")
+
+    def submit(self, request: dict) -> str:
+        """
+        Validates a job request and queues it. Raises ValueError on bad input.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Job request must be a JSON object")
+        if not request.get("output_dir"):
+            raise ValueError("output_dir is required")
+        overrides = dict(request.get("config") or {})
+        overrides["OUTPUT_DIR"] = request["output_dir"]
+        if request.get("input_dir"):
+            overrides["INPUT_DIR"] = request["input_dir"]
+        config = apply_overrides(self.config, overrides)
+
+        if request.get("files"):
+            if not isinstance(request["files"], list):
+                raise ValueError("files must be a list of file names")
+            rgb_files = [Path(name) if Path(name).is_absolute() else config.INPUT_DIR / name
+                         for name in request["files"]]
+        elif request.get("input_dir"):
+            rgb_files = sorted(config.INPUT_DIR.glob("*_Z.JPG"))
+        else:
+            raise ValueError("input_dir or files is required")
+
+        job = Job(config, rgb_files)
+        with self._lock:
+            self.jobs[job.id] = job
+        self.runner.submit(self._run, job)
+        logger.info(f"[{job.id}] Queued {len(rgb_files)} pair(s) -> {config.OUTPUT_DIR}")
+        return job.id
+
+    def _run(self, job: Job) -> None:
+        job.state, job.started = "running", time.time()
+        try:
+            (job.config.OUTPUT_DIR / "output").mkdir(parents=True, exist_ok=True)
+            run_batch(job.rgb_files, job.config, executor=self.executor,
+                      on_result=lambda res: self._record(job, res), progress=False)
+            write_metrics([res for res in job.results if res.status != "DONE"], metrics_path(job.config))
+            job.state = "done"
+        except Exception as e:
+            job.state, job.error = "failed", str(e)
+            logger.error(f"[{job.id}] Failed: {e}")
+        finally:
+            job.finished = time.time()
+            self._prune()
+        logger.info(f"[{job.id}] {job.state}: {job.to_dict()['counts']} in {job.finished - job.started:.2f}s")
+
+    def _prune(self) -> None:
+        """
+        Forgets the oldest finished jobs beyond FINISHED_JOBS (queued / running ones are kept).
+        """
+        with self._lock:
+            finished = sorted((job for job in self.jobs.values() if job.finished is not None),
+                              key=lambda job: job.finished)
+            for job in finished[:max(0, len(finished) - FINISHED_JOBS)]:
+                del self.jobs[job.id]
+
+    def _record(self, job: Job, result: PairResult) -> None:
+        with self._lock:
+            job.results.append(result)
+            self.pair_counts[result.status] += 1
+            if result.status == "OK":
+                self.recent.append(result)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return job.to_dict(with_results=job.state in ("done", "failed")) if job else None
+
+    def list_jobs(self) -> List[dict]:
+        return [job.to_dict() for job in list(self.jobs.values())]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            recent = list(self.recent)
+        return {
+            "uptime": time.time() - self.started,
+            "workers": self.config.MAX_WORKERS,
+            "jobs": dict(Counter(job.state for job in list(self.jobs.values()))),
+            "pairs": dict(self.pair_counts),
+            "stages": {name: dict(zip(("p50", "p95", "p99"), values))
+                       for name, values in stage_percentiles(recent).items()}
+        }
+
+    def close(self) -> None:
+        self.runner.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+
+# ================= HTTP FRONT END =================
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP for an OverlayService (set on the server as .service).
+    """
+    server_version = "OverlayDaemon/1.0"
+
+    def _reply(self, code: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        service = self.server.service
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._reply(200, service.metrics())
+        elif self.path == "/jobs":
+            self._reply(200, service.list_jobs())
+        elif self.path.startswith("/jobs/"):
+            status = service.status(self.path[len("/jobs/"):])
+            self._reply(200 if status else 404, status or {"error": "unknown job"})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path == "/shutdown":
+            self._reply(200, {"status": "stopping"})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if self.path != "/jobs":
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job_id = self.server.service.submit(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, TypeError) as e:
+            self._reply(400, {"error": str(e)})
+            return
+        self._reply(202, {"id": job_id})
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(config: Config) -> None:
+    """
+    Runs the daemon until Ctrl+C or POST /shutdown.
+    """
+    if config.DAEMON_HOST not in ("127.0.0.1", "localhost", "::1"):
+        logger.warning(f"Listening on {config.DAEMON_HOST}: jobs name arbitrary local paths, keep it firewalled")
+
+    service = OverlayService(config)
+    server = ThreadingHTTPServer((config.DAEMON_HOST, config.DAEMON_PORT), ServiceHandler)
+    server.service = service
+    logger.info(f"Overlay daemon on http://{config.DAEMON_HOST}:{config.DAEMON_PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("Stopping, finishing queued jobs...")
+        service.close()
+
+
+# ================= CLIENTS =================
+class HttpClient:
+    """
+    Client for a running daemon.
+    """
+
+    def __init__(self, url: str = "http://127.0.0.1:8765"):
+        self.url = url.rstrip("/")
+
+    def _call(self, method: str, path: str, payload: Optional[dict] = None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def submit(self, output_dir: Path, input_dir: Optional[Path] = None,
+               files: Optional[List[str]] = None, config: Optional[dict] = None) -> str:
+        payload = {"output_dir": str(output_dir), "input_dir": str(input_dir) if input_dir else None,
+                   "files": [str(name) for name in files] if files else None, "config": config}
+        return self._call("POST", "/jobs", payload)["id"]
+
+    def status(self, job_id: str) -> dict:
+        return self._call("GET", f"/jobs/{job_id}")
+
+    def metrics(self) -> dict:
+        return self._call("GET", "/metrics")
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, interval: float = 0.05) -> dict:
+        """
+        Polls until the job is done or failed (TimeoutError after timeout seconds).
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            status = self.status(job_id)
+            if status["state"] in ("done", "failed"):
+                return status
+            if deadline and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} still {status['state']}")
+            time.sleep(interval)
+
+
+class LocalClient(HttpClient):
+    """
+    Same calls as HttpClient against an in-process OverlayService (no socket).
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.service = OverlayService(config or Config())
+
+    def _call(self, method: str, path: str, payload: Optional[dict] = None):
+        # JSON round trip keeps the payloads identical to the HTTP ones
+        if method == "POST" and path == "/jobs":
+            return {"id": self.service.submit(json.loads(json.dumps(payload)))}
+        if path == "/metrics":
+            return json.loads(json.dumps(self.service.metrics()))
+        status = self.service.status(path[len("/jobs/"):])
+        if status is None:
+            raise KeyError(f"Unknown job: {path}")
+        return json.loads(json.dumps(status))
+
+    def close(self) -> None:
+        self.service.close()
+
+
+# ================= MAIN ENTRY POINT =================
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RGB / Thermal overlay service")
+    parser.add_argument("--host", help="Override Config.DAEMON_HOST")
+    parser.add_argument("--port", type=int, help="Override Config.DAEMON_PORT")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--jobs", type=int, help="Override Config.DAEMON_JOBS")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cfg = Config()
+    if args.host:
+        cfg = replace(cfg, DAEMON_HOST=args.host)
+    if args.port:
+        cfg = replace(cfg, DAEMON_PORT=args.port)
+    if args.workers:
+        cfg = replace(cfg, MAX_WORKERS=args.workers)
+    if args.jobs:
+        cfg = replace(cfg, DAEMON_JOBS=args.jobs)
+
+    serve(cfg)
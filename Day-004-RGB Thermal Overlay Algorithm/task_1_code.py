@@ -1,12 +1,32 @@
 import cv2
 import numpy as np
+import os
+import sys
+import json
 import logging
+import threading
+import time
+import queue
+import multiprocessing.util
+import zlib
+import hashlib
+import cProfile
+from contextlib import contextmanager, nullcontext
+from collections import deque, defaultdict
+import argparse
+from functools import lru_cache, partial
+from itertools import repeat
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Tuple, Optional, List
-from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace, asdict
+from typing import Tuple, Optional, List, Dict, Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm  # Professional Progress Bar
 
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
 # ================= CONFIGURATION =================
 @dataclass
 class Config:
@@ -15,16 +35,98 @@ class Config:
     OUTPUT_DIR: Path = Path(r"C:\Users\vipin\Downloads\ProductizeTech - AI Fulltime Assignment-20251122T062524Z-1-001\ProductizeTech - AI Fulltime Assignment\Task 1 - RGB Thermal Overlay Algorithm\task_1_output")
     
     # Alignment Parameters
+    BACKEND: str = "template"  # "template" (scale loop) | "fourier" (log-polar phase correlation)
     SCALE_RANGE: Tuple[float, float] = (0.90, 1.11)
     SCALE_STEP: float = 0.02
+    SEARCH_STRATEGY: str = "exhaustive"  # "exhaustive" | "pyramid" | "golden"
+    PYRAMID_LEVELS: int = 4    # Levels incl. full-res (4 -> 1/8 ... 1); fewer than 3 usable -> exhaustive
+    PYRAMID_RADIUS: int = 4    # Translation refine window (px) per level
+    PYRAMID_MIN_SIZE: int = 256  # Coarsest level keeps at least this short side (px)
+    PYRAMID_CANDIDATES: int = 3  # Hypotheses carried from the coarse levels
+    GOLDEN_PROBES: int = 5     # Evenly spaced scales probed before narrowing (guards against side peaks)
+    GOLDEN_EXIT_SCORE: float = 0.7  # Score at which golden search stops narrowing and only hill-climbs
+    FOURIER_SIZE: int = 1024   # Longest side of the working image for the fourier backend
+    SEARCH_DECODE_REDUCTION: int = 1  # 1 | 2 | 4 | 8: JPEG-level downscaled decode for the search
+
+    # Calibration Profile (fixed rig -> one warp per camera)
+    PROFILE_PATH: Optional[Path] = None  # JSON profile; None = always search
+    CAMERA_ID: Optional[str] = None      # Override the auto camera key (e.g. serial)
+    PROFILE_MIN_SCORE: float = 0.15      # Verify score below this -> full search fallback
+    PROFILE_MIN_RATIO: float = 0.8       # ... or below this x the verify score recorded at calibration
+    CALIBRATION_MIN_SCORE: float = 0.18  # Pairs below this are ignored when fitting
+
+    # Two-Tier Scheduling (cheap pass for all, wide re-search for the rest)
+    TWO_TIER: bool = False
+    NARROW_SCALE_RANGE: Tuple[float, float] = (0.96, 1.05)
+    NARROW_SCALE_STEP: float = 0.02
+    WIDE_SCALE_RANGE: Tuple[float, float] = (0.80, 1.21)
+    WIDE_SCALE_STEP: float = 0.01
+    # Tier-1 score below this -> tier-2 queue (and a low-confidence warning). Correct fits on
+    # real RGB / thermal pairs score ~0.18-0.31, gross misses well under 0.1 (same scale as
+    # PROFILE_MIN_SCORE); synthetic same-scene pairs score higher and are no guide here.
+    RETRY_SCORE: float = 0.15
     
     # Visual Parameters
     ALPHA: float = 0.6  # RGB Intensity
     BETA: float = 0.4   # Thermal Intensity
     COLORMAP: int = cv2.COLORMAP_JET
+    BLEND_MODE: str = "alpha"  # "alpha" | "screen" | "hot" (blend only the hottest thermal levels)
+    HOT_THRESHOLD: int = 160   # CLAHE-enhanced level from which "hot" mode blends
     
-    # System
-    MAX_WORKERS: int = 4  # Adjust based on your CPU cores
+    # Output Encoding
+    OUTPUT_MODE: str = "baked"   # "baked" (overlay image) | "layered" (sidecar + aligned thermal) | "both"
+    LAYER_THERMAL: bool = True   # Layered: also write the aligned thermal as a single-channel PNG
+    OUTPUT_FORMAT: str = "jpg"   # "jpg" | "png" | "webp"
+    JPEG_QUALITY: int = 95
+    JPEG_OPTIMIZE: bool = False
+    JPEG_PROGRESSIVE: bool = False
+    PNG_COMPRESSION: int = 3     # 0-9
+    WEBP_QUALITY: int = 90
+    ASYNC_WRITE: bool = True     # Encode + write on background threads in each worker
+    WRITER_THREADS: int = 1
+    WRITER_QUEUE: int = 4        # Frames waiting for the writer before the worker blocks
+
+    # Metrics & Profiling
+    METRICS_PATH: Optional[Path] = None  # Per-pair JSONL records; None = OUTPUT_DIR/pipeline_metrics.jsonl
+    PROFILER: str = ""                   # "" | "cprofile" | "pyinstrument"
+    PROFILER_SAMPLE_RATE: float = 0.0    # Fraction of pairs profiled (stable per file name)
+
+    # System (0 = auto from os.cpu_count())
+    MAX_WORKERS: int = 0    # Processes across pairs
+    SCALE_THREADS: int = 0  # Threads across scale candidates inside one pair
+    CV_THREADS: int = 0     # cv2.setNumThreads per process
+    CHUNKSIZE: int = 0      # executor.map chunksize
+
+    # Memory (bounded mode: 16-bit Sobel + reusable per-worker scratch buffers)
+    MEMORY_BOUNDED: bool = False
+    WORKER_MEMORY_MB: int = 0    # Per-process cap; 0 = unbounded
+    MEMORY_BUDGET_MB: int = 0    # Total for all processes; 0 = physical RAM
+
+    # Streaming Ingest (--watch)
+    WATCH_INTERVAL: float = 2.0  # Poll period (s); a file is complete once unchanged for one period
+    WATCH_QUEUE: int = 0         # Max pairs in flight; 0 = 2 x MAX_WORKERS
+    WATCH_IDLE_EXIT: float = 0.0 # Stop after this many idle seconds; 0 = run until Ctrl+C
+
+    # Run Manifest (incremental / resumable runs)
+    MANIFEST: bool = True                 # Hash inputs, skip unchanged pairs, reuse cached alignments
+    MANIFEST_PATH: Optional[Path] = None  # JSONL log; None = OUTPUT_DIR/run_manifest.jsonl
+    FORCE_RERUN: bool = False             # Ignore previous entries (new results are still recorded)
+
+    # Tiled Mode (orthomosaics, see tiled_overlay.py)
+    OVERVIEW_SIZE: int = 4096   # Longest side of the overview the alignment runs on
+    TILE_SIZE: int = 2048       # Output tile edge (px)
+
+    # Video Mode (see video_overlay.py)
+    VIDEO_TRACK_WIDTH: int = 960       # Frame width the alignment is searched / tracked at
+    VIDEO_REFINE_RADIUS: int = 6       # Translation window (px at track width) around the last fit
+    VIDEO_RESEARCH_SCORE: float = 0.2  # Refined score below this -> full search again
+    VIDEO_RESEARCH_DROP: float = 0.6   # ...or below this fraction of the last full search's score
+    VIDEO_FOURCC: str = "mp4v"
+
+    # Service Mode (see overlay_daemon.py)
+    DAEMON_HOST: str = "127.0.0.1"  # Loopback only unless explicitly changed
+    DAEMON_PORT: int = 8765
+    DAEMON_JOBS: int = 1            # Jobs run side by side (their pairs share the warm pool)
 
 # ================= LOGGING SETUP =================
 logging.basicConfig(
@@ -37,17 +139,268 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ================= EXECUTION MODEL =================
+def plan_execution(config: Config, n_pairs: int) -> Config:
+    """
+    Resolves the auto (0) execution settings for a batch of n_pairs.
+    Few pairs -> fewer processes and more scale threads per pair;
+    the product of all three never exceeds the core count.
+    """
+    cpus = os.cpu_count() or 1
+    processes = config.MAX_WORKERS or max(1, min(cpus, n_pairs))
+
+    # Never start more processes than the memory budget holds at WORKER_MEMORY_MB each
+    if config.WORKER_MEMORY_MB:
+        budget = config.MEMORY_BUDGET_MB or physical_memory_mb()
+        if budget:
+            processes = max(1, min(processes, budget // config.WORKER_MEMORY_MB))
+
+    scale_threads = config.SCALE_THREADS or max(1, cpus // processes)
+    cv_threads = config.CV_THREADS or max(1, cpus // (processes * scale_threads))
+    chunksize = config.CHUNKSIZE or max(1, min(8, n_pairs // (processes * 4)))
+    return replace(config, MAX_WORKERS=processes, SCALE_THREADS=scale_threads,
+                   CV_THREADS=cv_threads, CHUNKSIZE=chunksize)
+
+
+def physical_memory_mb() -> int:
+    """
+    Installed RAM in MB (0 if the platform does not expose it).
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+def init_worker(cv_threads: int) -> None:
+    """
+    Pool initializer: caps OpenCV's own threading inside each process.
+    """
+    cv2.setNumThreads(cv_threads)
+
+
+@lru_cache(maxsize=None)
+def scale_pool(threads: int) -> ThreadPoolExecutor:
+    """
+    Per-process thread pool for the scale sweep (OpenCV releases the GIL).
+    """
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix="scale")
+
+# ================= METRICS =================
+# "encode" is a synchronous encode + write; with ASYNC_WRITE the worker only
+# pays "handoff" (queueing, incl. waiting on a full queue), the encode runs off the clock
+PIPELINE_STAGES = ("hash", "decode", "skeleton", "match", "reconstruct", "overlay", "encode", "handoff")
+
+
+class StageTimer:
+    """
+    Accumulates wall seconds per pipeline stage for one pair.
+    Threaded scale sweeps add up per thread, so search stages may exceed wall time.
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.totals[name] += elapsed
+
+
+_active_timer: Optional[StageTimer] = None
+
+
+def stage(name: str):
+    """
+    Times a block against the pair currently processed by this worker (no-op otherwise).
+    """
+    timer = _active_timer
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process so far (None where unsupported).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextmanager
+def maybe_profile(config: Config, base_name: str):
+    """
+    Samples PROFILER_SAMPLE_RATE of the pairs into OUTPUT_DIR/profiles.
+    Sampling hashes the pair name, so reruns profile the same pairs.
+    """
+    sampled = (config.PROFILER and
+               zlib.crc32(base_name.encode()) % 10000 < config.PROFILER_SAMPLE_RATE * 10000)
+    if not sampled:
+        yield
+        return
+
+    out_dir = config.OUTPUT_DIR / "profiles"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if config.PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, profiling skipped")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            (out_dir / f"{base_name}.html").write_text(profiler.output_html(), encoding="utf-8")
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(out_dir / f"{base_name}.prof"))
+
+
+def metrics_path(config: Config) -> Path:
+    return config.METRICS_PATH or config.OUTPUT_DIR / "pipeline_metrics.jsonl"
+
+
+def write_metrics(results: list, path: Path) -> None:
+    """
+    Appends one JSON record per pair.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for res in results:
+            f.write(json.dumps(asdict(res)) + "\n")
+
+
+def stage_percentiles(results: list) -> Dict[str, Tuple[float, float, float]]:
+    """
+    p50 / p95 / p99 seconds per stage over the given pair results.
+    """
+    report = {}
+    for name in PIPELINE_STAGES + ("total",):
+        values = [res.timings[name] for res in results if name in res.timings]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            report[name] = (float(p50), float(p95), float(p99))
+    return report
+
+
+def log_stage_report(results: list) -> None:
+    report = stage_percentiles(results)
+    if not report:
+        return
+    logger.info("--- Stage Latency (s)      p50      p95      p99 ---")
+    for name, (p50, p95, p99) in report.items():
+        logger.info(f"    {name:<20} {p50:8.3f} {p95:8.3f} {p99:8.3f}")
+
+# ================= SCRATCH BUFFERS =================
+class SkeletonBuffers:
+    """
+    Reusable intermediates of extract_skeleton: two ping-pong uint8 planes
+    plus the int16 Sobel plane (4 bytes/px in total).
+    Flat storage sized for the largest frame seen; smaller frames (other
+    scales, pyramid levels, pairs) get contiguous views into it.
+    """
+    FIELDS = (("front", np.uint8), ("back", np.uint8), ("sobel", np.int16))
+    BYTES_PER_PX = sum(np.dtype(dtype).itemsize for _, dtype in FIELDS)
+
+    def __init__(self):
+        self._storage: Dict[str, np.ndarray] = {}
+        self.capacity = 0
+
+    def fit(self, shape: Tuple[int, ...]) -> "SkeletonBuffers":
+        h, w = shape[:2]
+        if h * w > self.capacity:
+            self.capacity = h * w
+            self._storage = {name: np.empty(self.capacity, dtype=dtype) for name, dtype in self.FIELDS}
+
+        for name, _ in self.FIELDS:
+            setattr(self, name, self._storage[name][:h * w].reshape(h, w))
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buf.nbytes for buf in self._storage.values())
+
+
+class BufferPool:
+    """
+    Named SkeletonBuffers, bounded in bytes.
+    Slots keep simultaneously live skeletons (e.g. "rgb" and "thermal") apart,
+    so they never evict each other: a slot only grows while all slots still
+    fit in max_bytes, a frame that would overflow gets one-off buffers instead.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self._slots: Dict[str, SkeletonBuffers] = {}
+
+    def get(self, slot: str, shape: Tuple[int, ...]) -> SkeletonBuffers:
+        h, w = shape[:2]
+        buffers = self._slots.get(slot) or SkeletonBuffers()
+        if self.max_bytes and h * w > buffers.capacity:
+            others = self.nbytes - buffers.nbytes
+            if others + h * w * SkeletonBuffers.BYTES_PER_PX > self.max_bytes:
+                return SkeletonBuffers().fit(shape)
+        self._slots[slot] = buffers.fit(shape)
+        return buffers
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buf.nbytes for buf in self._slots.values())
+
+
+_thread_state = threading.local()
+
+
+def buffer_pool(config: Config) -> Optional[BufferPool]:
+    """
+    Calling thread's BufferPool (None unless MEMORY_BOUNDED).
+    Half of WORKER_MEMORY_MB goes to scratch, shared by the scale threads.
+    """
+    if not config.MEMORY_BOUNDED:
+        return None
+
+    pool = getattr(_thread_state, "buffer_pool", None)
+    if pool is None:
+        pool = BufferPool()
+        _thread_state.buffer_pool = pool
+    pool.max_bytes = config.WORKER_MEMORY_MB * 1024 * 1024 // (2 * max(1, config.SCALE_THREADS))
+    return pool
+
 # ================= CORE ENGINE =================
 class AlignmentEngine:
     """
     Encapsulates all logic for Image Registration and Overlay.
     """
+    PYRAMID_MIN_LEVELS = 3  # Shallower pyramids lose accuracy: search_pyramid sweeps exhaustively instead
 
     @staticmethod
-    def extract_skeleton(img: np.ndarray) -> np.ndarray:
+    def extract_skeleton(img: np.ndarray, buffers: Optional[SkeletonBuffers] = None) -> np.ndarray:
         """
         Extracts vertical structural elements (poles) using adaptive thresholds.
+        With buffers, runs the memory-bounded path (result lives in buffers.clean).
         """
+        if buffers is not None:
+            return AlignmentEngine._extract_skeleton_bounded(img, buffers)
+
         if len(img.shape) == 3:
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         else:
@@ -76,16 +429,135 @@ class AlignmentEngine:
 
         return clean
 
+    @staticmethod
+    def _extract_skeleton_bounded(img: np.ndarray, buf: SkeletonBuffers) -> np.ndarray:
+        """
+        Same steps as extract_skeleton, ping-ponged between preallocated
+        buffers with a 16-bit Sobel (2 bytes/px instead of 8).
+        The input may itself be buf.front (e.g. a resized thermal frame).
+        The result lives in buf.front until the buffers are reused.
+        """
+        if len(img.shape) == 3:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=buf.front)
+        else:
+            gray = img  # Read-only below, no copy needed
+
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0, dst=buf.back)
+        norm = cv2.normalize(blurred, buf.front, 0, 255, cv2.NORM_MINMAX)
+
+        # |Sobel x| <= 4 * 255 fits int16; unsafe cast wraps mod 256 like np.uint8(float64)
+        sobelx = cv2.Sobel(norm, cv2.CV_16S, 1, 0, dst=buf.sobel, ksize=3)
+        np.abs(sobelx, out=sobelx)
+        skeleton = buf.front
+        np.copyto(skeleton, sobelx, casting="unsafe")
+
+        # Median from a 256-bin histogram (np.median would copy the frame)
+        counts = np.cumsum(np.bincount(skeleton.ravel(), minlength=256))
+        n = counts[-1]
+        v = (np.searchsorted(counts, (n - 1) // 2, side="right") +
+             np.searchsorted(counts, n // 2, side="right")) / 2.0
+        lower = int(max(40, (1.0 - 0.33) * v))
+        _, binary = cv2.threshold(skeleton, lower, 255, cv2.THRESH_BINARY, dst=buf.back)
+
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        return cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, dst=buf.front)
+
+    @staticmethod
+    def extract_edges(img: np.ndarray) -> np.ndarray:
+        """
+        Float32 gradient magnitude (both axes) on the skeleton's blurred, normalised input.
+        """
+        if len(img.shape) == 3:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = img
+
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        norm = cv2.normalize(blurred, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_32F)
+
+        grad_x = cv2.Sobel(norm, cv2.CV_32F, 1, 0, ksize=3)
+        grad_y = cv2.Sobel(norm, cv2.CV_32F, 0, 1, ksize=3)
+        return cv2.magnitude(grad_x, grad_y)
+
+    @staticmethod
+    def _map_scales(fn, items: list, config: Config) -> list:
+        """
+        Evaluates scale candidates, threaded when SCALE_THREADS > 1 (order preserved).
+        """
+        if config.SCALE_THREADS > 1 and len(items) > 1:
+            return list(scale_pool(config.SCALE_THREADS).map(fn, items))
+        return [fn(item) for item in items]
+
     @classmethod
-    def find_optimal_alignment(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> np.ndarray:
+    def match_scale(cls, skel_rgb: np.ndarray, thermal_raw: np.ndarray, scale: float,
+                    start_hint: Optional[Tuple[int, int]] = None, radius: int = 0,
+                    pool: Optional[BufferPool] = None) -> Optional[dict]:
         """
-        Performs Multi-Scale Template Matching to find best alignment.
-        Returns the aligned thermal image (same size as RGB).
+        Scores one scale candidate against a pre-computed RGB skeleton.
+        With a start hint, only a +/- radius window around it is searched.
+        """
+        h_rgb, w_rgb = skel_rgb.shape[:2]
+
+        # Resize thermal
+        t_w, t_h = int(w_rgb * scale), int(h_rgb * scale)
+        with stage("skeleton"):
+            if pool is None:
+                thermal_scaled = cv2.resize(thermal_raw, (t_w, t_h))
+                skel_thermal = cls.extract_skeleton(thermal_scaled)
+            else:
+                buffers = pool.get("thermal", (t_h, t_w))
+                thermal_scaled = cv2.resize(thermal_raw, (t_w, t_h), dst=buffers.front)
+                skel_thermal = cls.extract_skeleton(thermal_scaled, buffers)
+
+        # Crop Template (Center 50%)
+        th, tw = skel_thermal.shape
+        crop_h, crop_w = int(th * 0.5), int(tw * 0.5)
+        cy, cx = th // 2, tw // 2
+
+        # ROI Coordinates
+        y1, y2 = cy - crop_h // 2, cy + crop_h // 2
+        x1, x2 = cx - crop_w // 2, cx + crop_w // 2
+
+        template = skel_thermal[y1:y2, x1:x2]
+
+        # Validation
+        if template.shape[0] >= h_rgb or template.shape[1] >= w_rgb:
+            return None
+
+        # Template Matching
+        if start_hint is None:
+            with stage("match"):
+                res = cv2.matchTemplate(skel_rgb, template, cv2.TM_CCOEFF_NORMED)
+                _, max_val, _, max_loc = cv2.minMaxLoc(res)
+        else:
+            # Windowed search: predicted template position +/- radius
+            max_x, max_y = w_rgb - template.shape[1], h_rgb - template.shape[0]
+            px, py = start_hint[0] + x1, start_hint[1] + y1
+            wx1, wx2 = min(max(0, px - radius), max_x), min(max(0, px + radius), max_x)
+            wy1, wy2 = min(max(0, py - radius), max_y), min(max(0, py + radius), max_y)
+
+            region = skel_rgb[wy1:wy2 + template.shape[0], wx1:wx2 + template.shape[1]]
+            with stage("match"):
+                res = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+                _, max_val, _, max_loc = cv2.minMaxLoc(res)
+            max_loc = (max_loc[0] + wx1, max_loc[1] + wy1)
+
+        return {
+            "score": max_val,
+            "scale": scale,
+            "loc": max_loc,          # Top-left in RGB
+            "offset": (x1, y1)       # Top-left in Thermal Scaled
+        }
+
+    @classmethod
+    def search_exhaustive(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> dict:
+        """
+        Brute-force sweep over every scale at full resolution.
         """
-        h_rgb, w_rgb = rgb_img.shape[:2]
-        
         # Pre-calculate RGB skeleton once
-        skel_rgb = cls.extract_skeleton(rgb_img)
+        pool = buffer_pool(config)
+        with stage("skeleton"):
+            skel_rgb = cls.extract_skeleton(rgb_img, pool and pool.get("rgb", rgb_img.shape))
 
         best_result = {
             "score": -1.0,
@@ -97,39 +569,303 @@ class AlignmentEngine:
         # Generate scales
         scales = np.arange(config.SCALE_RANGE[0], config.SCALE_RANGE[1], config.SCALE_STEP)
 
-        for scale in scales:
-            # Resize thermal
-            t_w, t_h = int(w_rgb * scale), int(h_rgb * scale)
-            thermal_scaled = cv2.resize(thermal_raw, (t_w, t_h))
-            
-            skel_thermal = cls.extract_skeleton(thermal_scaled)
+        results = cls._map_scales(lambda scale: cls.match_scale(skel_rgb, thermal_raw, scale,
+                                                                pool=buffer_pool(config)),
+                                  list(scales), config)
+        for result in results:
+            if result is not None and result["score"] > best_result["score"]:
+                best_result = result
 
-            # Crop Template (Center 50%)
-            th, tw = skel_thermal.shape
-            crop_h, crop_w = int(th * 0.5), int(tw * 0.5)
-            cy, cx = th // 2, tw // 2
-            
-            # ROI Coordinates
-            y1, y2 = cy - crop_h // 2, cy + crop_h // 2
-            x1, x2 = cx - crop_w // 2, cx + crop_w // 2
-            
-            template = skel_thermal[y1:y2, x1:x2]
+        return best_result
 
-            # Validation
-            if template.shape[0] >= h_rgb or template.shape[1] >= w_rgb:
-                continue
+    @classmethod
+    def search_pyramid(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> dict:
+        """
+        Coarse-to-fine search.
+        Full scale sweep on the coarsest level, then each finer level only
+        re-checks the neighbouring scales of the best few hypotheses inside a
+        small translation window. Frames too small for PYRAMID_MIN_LEVELS
+        levels get the exhaustive sweep.
+        """
+        h_rgb, w_rgb = rgb_img.shape[:2]
+        scales = np.arange(config.SCALE_RANGE[0], config.SCALE_RANGE[1], config.SCALE_STEP)
+        levels = max(1, config.PYRAMID_LEVELS)
+        # Small frames / reduced decodes: fewer levels, the skeleton needs some detail left
+        while levels > 1 and min(h_rgb, w_rgb) // 2 ** (levels - 1) < config.PYRAMID_MIN_SIZE:
+            levels -= 1
+        if levels < cls.PYRAMID_MIN_LEVELS:
+            # A half-resolution sweep + one +/-PYRAMID_RADIUS refine misses the full-res optimum
+            return cls.search_exhaustive(rgb_img, thermal_raw, config)
+
+        # Beam of hypotheses: (scale index, thermal centre in the next level's pixels)
+        beam: List[Tuple[int, Optional[Tuple[float, float]]]] = [(idx, None) for idx in range(len(scales))]
+        best_result = None
+
+        for level in range(levels - 1, -1, -1):
+            factor = 2 ** level
+            if factor == 1:
+                rgb_level = rgb_img
+            else:
+                size = (max(1, w_rgb // factor), max(1, h_rgb // factor))
+                rgb_level = cv2.resize(rgb_img, size, interpolation=cv2.INTER_AREA)
+
+            h_level, w_level = rgb_level.shape[:2]
+            pool = buffer_pool(config)
+            with stage("skeleton"):
+                skel_rgb = cls.extract_skeleton(rgb_level, pool and pool.get("rgb", rgb_level.shape))
+
+            # Coarsest level: full sweep. Finer levels: neighbouring scales of
+            # each surviving hypothesis, the final level keeps the scale.
+            span = 1 if level > 0 else 0
+            tasks = []
+            for idx, center in beam:
+                if center is None:
+                    tasks.append((idx, None))
+                    continue
+                for near in range(max(0, idx - span), min(len(scales), idx + span + 1)):
+                    if (near, center) not in tasks:
+                        tasks.append((near, center))
+
+            def evaluate(task):
+                idx, center = task
+                start_hint = None
+                if center is not None:
+                    # Re-anchor on the thermal centre, which does not move with scale
+                    t_w, t_h = int(w_level * scales[idx]), int(h_level * scales[idx])
+                    start_hint = (int(round(center[0] - t_w / 2)), int(round(center[1] - t_h / 2)))
+                return idx, cls.match_scale(skel_rgb, thermal_raw, scales[idx],
+                                            start_hint=start_hint, radius=config.PYRAMID_RADIUS,
+                                            pool=buffer_pool(config))
+
+            # Stable sort keeps the serial tie-break (first candidate wins)
+            ranked = [(idx, result) for idx, result in cls._map_scales(evaluate, tasks, config)
+                      if result is not None]
+            ranked.sort(key=lambda item: -item[1]["score"])
+            if not ranked:
+                break
+            best_result = ranked[0][1]
+
+            # Keep the top hypotheses (only the best one goes to full resolution)
+            keep = max(1, config.PYRAMID_CANDIDATES) if level > 1 else 1
+            beam = []
+            for idx, result in ranked[:keep]:
+                # Thermal centre projected to the next (2x finer) level
+                t_w, t_h = int(w_level * result["scale"]), int(h_level * result["scale"])
+                beam.append((idx, ((result["loc"][0] - result["offset"][0] + t_w / 2) * 2,
+                                   (result["loc"][1] - result["offset"][1] + t_h / 2) * 2)))
+
+        if best_result is None or factor != 1:
+            # Degenerate pyramid: fall back to the brute-force sweep
+            return cls.search_exhaustive(rgb_img, thermal_raw, config)
+        return best_result
+
+    @classmethod
+    def search_golden(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> dict:
+        """
+        Golden-section search over the scale grid (score ~unimodal in scale).
+        GOLDEN_PROBES evenly spaced scales pick the bracket, golden-section
+        narrows it, and a final hill-climb settles on the grid. Each grid
+        scale is matched at most once; a score >= GOLDEN_EXIT_SCORE skips
+        straight to the hill-climb.
+        """
+        pool = buffer_pool(config)
+        with stage("skeleton"):
+            skel_rgb = cls.extract_skeleton(rgb_img, pool and pool.get("rgb", rgb_img.shape))
+
+        scales = np.arange(config.SCALE_RANGE[0], config.SCALE_RANGE[1], config.SCALE_STEP)
+        evaluated: Dict[int, Optional[dict]] = {}
+
+        def score(idx: int) -> float:
+            result = evaluated[idx]
+            return result["score"] if result is not None else -1.0
+
+        def evaluate(indices: List[int]) -> None:
+            todo = [idx for idx in dict.fromkeys(indices) if idx not in evaluated]
+            results = cls._map_scales(lambda idx: cls.match_scale(skel_rgb, thermal_raw, scales[idx],
+                                                                  pool=buffer_pool(config)),
+                                      todo, config)
+            evaluated.update(zip(todo, results))
+
+        def best_idx() -> int:
+            # Ties -> lowest scale, like the exhaustive sweep
+            return max(sorted(evaluated), key=score)
+
+        # Bracket: evenly spaced probes, keep the neighbours of the best one
+        last = len(scales) - 1
+        probes = max(2, min(config.GOLDEN_PROBES, len(scales)))
+        grid = sorted({int(round(i * last / (probes - 1))) for i in range(probes)})
+        evaluate(grid)
+        at = grid.index(best_idx())
+        lo, hi = grid[max(0, at - 1)], grid[min(len(grid) - 1, at + 1)]
+
+        # Golden-section narrowing on grid indices
+        ratio = (np.sqrt(5) - 1) / 2
+        while hi - lo > 2 and score(best_idx()) < config.GOLDEN_EXIT_SCORE:
+            left = hi - int(round(ratio * (hi - lo)))
+            right = lo + int(round(ratio * (hi - lo)))
+            if left >= right:
+                left, right = (lo + hi) // 2, (lo + hi) // 2 + 1
+            evaluate([left, right])
+            if score(left) >= score(right):
+                hi = right
+            else:
+                lo = left
+
+        # Hill-climb on the grid from the best scale seen
+        idx = best_idx()
+        while True:
+            evaluate([max(0, idx - 1), min(last, idx + 1)])
+            step = best_idx()
+            if step == idx:
+                break
+            idx = step
+
+        best_result = evaluated[idx]
+        if best_result is None:
+            return {"score": -1.0, "scale": 1.0, "loc": (0, 0), "offset": (0, 0)}
+        return best_result
+
+    @staticmethod
+    def _log_polar_spectrum(img: np.ndarray, window: np.ndarray, band: float = 1.0) -> Tuple[np.ndarray, float]:
+        """
+        High-passed FFT magnitude of an image, resampled to log-polar.
+        Returns the log-polar image and its log-radius base.
+        The magnitude is first resampled onto a square grid (DC kept at the
+        centre): only then do both spectral axes share one frequency spacing,
+        so that an image rotation is a pure angular shift of the spectrum.
+        band (0-1] limits the log-polar radius to that fraction of Nyquist.
+        """
+        spectrum = np.fft.fftshift(np.fft.fft2(img.astype(np.float32) * window))
+        magnitude = np.log1p(np.abs(spectrum)).astype(np.float32)
+
+        h_img, w_img = magnitude.shape
+        if h_img != w_img:
+            side = max(h_img, w_img)
+            fx, fy = side / w_img, side / h_img
+            to_square = np.array([[fx, 0, side // 2 - (w_img // 2) * fx],
+                                  [0, fy, side // 2 - (h_img // 2) * fy]], dtype=np.float64)
+            magnitude = cv2.warpAffine(magnitude, to_square, (side, side), flags=cv2.INTER_LINEAR)
+
+        # High-pass emphasis suppresses the DC blob that dominates the correlation
+        h, w = magnitude.shape
+        yy = np.cos(np.pi * (np.arange(h, dtype=np.float32) / h - 0.5))
+        xx = np.cos(np.pi * (np.arange(w, dtype=np.float32) / w - 0.5))
+        magnitude *= 1.0 - np.outer(yy, xx)
+
+        center = (w / 2.0, h / 2.0)
+        max_radius = min(center) * band
+        log_polar = cv2.warpPolar(magnitude, (w, h), center, max_radius,
+                                  cv2.INTER_LINEAR + cv2.WARP_POLAR_LOG)
+        return log_polar, w / np.log(max_radius)
+
+    @classmethod
+    def search_fourier(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> dict:
+        """
+        Fourier-Mellin registration.
+        Scale and rotation come from phase correlation of the log-polar FFT
+        magnitudes, translation from a second phase correlation.
+        Uses full gradient magnitude: the vertical-only skeleton puts all
+        spectral energy on one axis, which carries no log-polar scale shift.
+        """
+        h_rgb, w_rgb = rgb_img.shape[:2]
+
+        # Working resolution (FFT cost is independent of the scale range)
+        work = min(1.0, config.FOURIER_SIZE / max(h_rgb, w_rgb))
+        w_work, h_work = max(1, int(w_rgb * work)), max(1, int(h_rgb * work))
+        rgb_work = cv2.resize(rgb_img, (w_work, h_work), interpolation=cv2.INTER_AREA)
+        thermal_work = cv2.resize(thermal_raw, (w_work, h_work))
+
+        with stage("skeleton"):
+            edges_rgb = cls.extract_edges(rgb_work)
+            edges_thermal = cls.extract_edges(thermal_work)
+        window = cv2.createHanningWindow((w_work, h_work), cv2.CV_32F)
+
+        # The thermal frame is upsampled to the working size: above its own
+        # Nyquist its spectrum is empty, and that band edge does not move with
+        # the scale. Keep the log-polar radius inside it (10% margin).
+        h_t, w_t = thermal_raw.shape[:2]
+        band = 0.9 * min(1.0, w_t / w_work, h_t / h_work)
+
+        # 1. Scale + Rotation (log-polar shift)
+        with stage("match"):
+            lp_rgb, log_base = cls._log_polar_spectrum(edges_rgb, window, band)
+            lp_thermal, _ = cls._log_polar_spectrum(edges_thermal, window, band)
+            (shift_x, shift_y), _ = cv2.phaseCorrelate(lp_rgb, lp_thermal)
+
+        rotation = 360.0 * shift_y / lp_rgb.shape[0]
+        # Magnitude spectra are 180 degree symmetric: keep the small-angle solution
+        rotation = (rotation + 90.0) % 180.0 - 90.0
+        scale = float(np.exp(shift_x / log_base))
 
-            # Template Matching
-            res = cv2.matchTemplate(skel_rgb, template, cv2.TM_CCOEFF_NORMED)
-            _, max_val, _, max_loc = cv2.minMaxLoc(res)
+        # 2. Translation on the de-rotated, de-scaled thermal edges
+        center = (w_work / 2.0, h_work / 2.0)
+        warp = cv2.getRotationMatrix2D(center, rotation, scale)
+        with stage("match"):
+            edges_thermal = cv2.warpAffine(edges_thermal, warp, (w_work, h_work))
+            (trans_x, trans_y), response = cv2.phaseCorrelate(edges_thermal, edges_rgb, window)
+
+        # Back to full-res RGB pixels: top-left of the scaled thermal frame
+        start_x = int(round(w_rgb / 2.0 + trans_x / work - scale * w_rgb / 2.0))
+        start_y = int(round(h_rgb / 2.0 + trans_y / work - scale * h_rgb / 2.0))
+
+        return {
+            "score": min(1.0, float(response)),
+            "scale": scale,
+            "rotation": rotation,
+            "loc": (start_x, start_y),
+            "offset": (0, 0)
+        }
+
+    @classmethod
+    def estimate_alignment(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> dict:
+        """
+        Runs the configured backend / search strategy.
+        Returns the best_result dict (score, scale, loc, offset[, rotation]) in RGB pixels.
+        """
+        if config.BACKEND == "fourier":
+            return cls.search_fourier(rgb_img, thermal_raw, config)
+        if config.BACKEND != "template":
+            raise ValueError(f"Unknown BACKEND: {config.BACKEND}")
+
+        if config.SEARCH_STRATEGY == "pyramid":
+            return cls.search_pyramid(rgb_img, thermal_raw, config)
+        if config.SEARCH_STRATEGY == "exhaustive":
+            return cls.search_exhaustive(rgb_img, thermal_raw, config)
+        if config.SEARCH_STRATEGY == "golden":
+            return cls.search_golden(rgb_img, thermal_raw, config)
+        raise ValueError(f"Unknown SEARCH_STRATEGY: {config.SEARCH_STRATEGY}")
+
+    @staticmethod
+    def alignment_matrix(best_result: dict, thermal_shape: Tuple[int, ...], rgb_shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        2x3 affine matrix mapping raw thermal pixels onto the RGB canvas.
+        """
+        h_rgb, w_rgb = rgb_shape[:2]
+        h_t, w_t = thermal_shape[:2]
+        final_w = int(w_rgb * best_result["scale"])
+        final_h = int(h_rgb * best_result["scale"])
+
+        start_x = best_result["loc"][0] - best_result["offset"][0]
+        start_y = best_result["loc"][1] - best_result["offset"][1]
+
+        # Resize -> rotate about the resized frame centre -> translate
+        resize = np.diag([final_w / w_t, final_h / h_t, 1.0])
+        rotate = np.vstack([cv2.getRotationMatrix2D((final_w / 2.0, final_h / 2.0),
+                                                    best_result.get("rotation", 0.0), 1.0), [0, 0, 1]])
+        translate = np.array([[1.0, 0, start_x], [0, 1.0, start_y], [0, 0, 1.0]])
+        return (translate @ rotate @ resize)[:2]
+
+    @staticmethod
+    def apply_alignment(thermal_raw: np.ndarray, best_result: dict, rgb_shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Places the thermal image on the RGB canvas using a search result.
+        """
+        h_rgb, w_rgb = rgb_shape[:2]
 
-            if max_val > best_result["score"]:
-                best_result = {
-                    "score": max_val,
-                    "scale": scale,
-                    "loc": max_loc,          # Top-left in RGB
-                    "offset": (x1, y1)       # Top-left in Thermal Scaled
-                }
+        if best_result.get("rotation", 0.0):
+            # Rotated fit (fourier backend): single affine warp
+            matrix = AlignmentEngine.alignment_matrix(best_result, thermal_raw.shape, rgb_shape)
+            return cv2.warpAffine(thermal_raw, matrix, (w_rgb, h_rgb))
 
         # --- RECONSTRUCTION ---
         final_w = int(w_rgb * best_result["scale"])
@@ -160,99 +896,1123 @@ class AlignmentEngine:
             
         return aligned_thermal
 
+    @staticmethod
+    def scale_result(best_result: dict, factor: float) -> dict:
+        """
+        Converts a search result between image resolutions (pixel fields only).
+        """
+        return dict(best_result,
+                    loc=(int(round(best_result["loc"][0] * factor)), int(round(best_result["loc"][1] * factor))),
+                    offset=(int(round(best_result["offset"][0] * factor)), int(round(best_result["offset"][1] * factor))))
+
+    @classmethod
+    def verify_alignment(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, best_result: dict,
+                         reduce: int = 2) -> float:
+        """
+        Cheap O(1) check of a known transform (no search).
+        Correlates RGB and aligned-thermal skeletons over the central region
+        at 1/reduce resolution (at 1/4, a 1.5% shift of a 640 px frame still
+        scored like a correct fit on some scenes).
+        """
+        h_rgb, w_rgb = rgb_img.shape[:2]
+        size = (max(1, w_rgb // reduce), max(1, h_rgb // reduce))
+        rgb_small = cv2.resize(rgb_img, size, interpolation=cv2.INTER_AREA)
+
+        aligned = cls.apply_alignment(thermal_raw, cls.scale_result(best_result, size[0] / w_rgb),
+                                      rgb_small.shape)
+
+        skel_rgb = cls.extract_skeleton(rgb_small)
+        skel_thermal = cls.extract_skeleton(aligned)
+
+        # Central 50% (inside the thermal footprint for any sane fit)
+        h, w = skel_rgb.shape
+        y1, y2, x1, x2 = h // 4, h - h // 4, w // 4, w - w // 4
+        res = cv2.matchTemplate(skel_rgb[y1:y2, x1:x2], skel_thermal[y1:y2, x1:x2], cv2.TM_CCOEFF_NORMED)
+        return float(res[0, 0])
+
+    @classmethod
+    def find_optimal_alignment(cls, rgb_img: np.ndarray, thermal_raw: np.ndarray, config: Config) -> np.ndarray:
+        """
+        Performs Multi-Scale Template Matching to find best alignment.
+        Returns the aligned thermal image (same size as RGB).
+        """
+        best_result = cls.estimate_alignment(rgb_img, thermal_raw, config)
+        return cls.apply_alignment(thermal_raw, best_result, rgb_img.shape)
+
     @staticmethod
     def create_smart_overlay(rgb: np.ndarray, aligned_thermal: np.ndarray, config: Config) -> np.ndarray:
         """
         Creates an overlay that preserves RGB sky clarity using masking.
         """
+        return overlay_engine(config).render(rgb, aligned_thermal)
+
+# ================= OVERLAY ENGINE =================
+class OverlayEngine:
+    """
+    In-place thermal overlay renderer.
+    Colormap and ALPHA/BETA weights are baked into lookup tables once;
+    blending writes straight into the output through a mask, so there are
+    no gather/scatter copies. Scratch planes are reused between calls.
+    """
+    MASK_MIN = 5  # Only blend where thermal data exists (keeps the sky clear)
+    CLAHE_CLIP = 4.0
+    CLAHE_GRID = (8, 8)
+
+    def __init__(self, config: Config):
+        if config.BLEND_MODE not in ("alpha", "screen", "hot"):
+            raise ValueError(f"Unknown BLEND_MODE: {config.BLEND_MODE}")
+        self.mode = config.BLEND_MODE
+        self.hot_threshold = config.HOT_THRESHOLD
+        self.clahe = cv2.createCLAHE(clipLimit=self.CLAHE_CLIP, tileGridSize=self.CLAHE_GRID)
+
+        levels = np.arange(256, dtype=np.uint8).reshape(256, 1)
+        colormap = cv2.applyColorMap(levels, config.COLORMAP).astype(np.float32)
+
+        # out = ALPHA * rgb + BETA * colormap(thermal), one table per term
+        self.alpha_lut = np.clip(np.round(np.arange(256) * config.ALPHA), 0, 255).astype(np.uint8)
+        self.beta_colormap = np.clip(np.round(colormap * config.BETA), 0, 255).astype(np.uint8)
+
+        self._planes: Dict[Tuple[str, Tuple[int, ...]], np.ndarray] = {}
+
+    def _plane(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        plane = self._planes.get((name, shape))
+        if plane is None:
+            # One shape per name: drop planes left over from other frame sizes
+            self._planes = {key: val for key, val in self._planes.items() if key[0] != name}
+            plane = self._planes[(name, shape)] = np.empty(shape, dtype=np.uint8)
+        return plane
+
+    def render(self, rgb: np.ndarray, aligned_thermal: np.ndarray,
+               out: Optional[np.ndarray] = None, enhanced: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Blends the thermal layer onto rgb and returns out.
+        out may be rgb itself (fully in place) or any caller-owned buffer.
+        enhanced replaces the CLAHE step when the contrast mapping was computed
+        elsewhere (tiled_overlay.py maps the whole mosaic, not just this window).
+        """
+        if out is None:
+            out = rgb.copy()
+        elif out is not rgb:
+            np.copyto(out, rgb)
+
+        h, w = aligned_thermal.shape[:2]
+
         # Contrast Enhancement (CLAHE)
-        clahe = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
-        enhanced = clahe.apply(aligned_thermal)
-        
-        # Apply Colormap
-        thermal_color = cv2.applyColorMap(enhanced, config.COLORMAP)
-        
-        # Smart Masking: Only blend where thermal data exists (> 5 pixel value)
-        # This keeps the sky blue instead of blending it with black thermal background
-        mask = aligned_thermal > 5
-        
-        output = rgb.copy()
-        
-        # Extract Regions of Interest
-        roi_rgb = output[mask]
-        roi_thermal = thermal_color[mask]
-        
-        # Alpha Blending
-        blended = cv2.addWeighted(roi_rgb, config.ALPHA, roi_thermal, config.BETA, 0)
-        
-        # Apply back
-        output[mask] = blended
-        return output
+        if enhanced is None:
+            enhanced = self.clahe.apply(aligned_thermal, dst=self._plane("enhanced", (h, w)))
+
+        # Blend mask (uint8, consumed by the masked cv2 ops below)
+        mask = cv2.compare(aligned_thermal, self.MASK_MIN, cv2.CMP_GT, dst=self._plane("mask", (h, w)))
+        if self.mode == "hot":
+            hot = cv2.compare(enhanced, self.hot_threshold, cv2.CMP_GE, dst=self._plane("hot", (h, w)))
+            cv2.bitwise_and(mask, hot, dst=mask)
+
+        # BETA * colormap(thermal) in one table lookup
+        thermal_term = cv2.applyColorMap(enhanced, self.beta_colormap, dst=self._plane("thermal", out.shape))
+
+        if self.mode == "screen":
+            # out + BETA * c * (255 - out) / 255
+            inverse = cv2.bitwise_not(out, dst=self._plane("rgb", out.shape))
+            lift = cv2.multiply(inverse, thermal_term, dst=inverse, scale=1.0 / 255)
+            cv2.add(out, lift, dst=out, mask=mask)
+        else:
+            rgb_term = cv2.LUT(out, self.alpha_lut, dst=self._plane("rgb", out.shape))
+            cv2.add(rgb_term, thermal_term, dst=out, mask=mask)
+
+        return out
+
+
+def overlay_engine(config: Config) -> OverlayEngine:
+    """
+    Calling thread's OverlayEngine for the config's visual settings.
+    """
+    engines = getattr(_thread_state, "overlay_engines", None)
+    if engines is None:
+        engines = _thread_state.overlay_engines = {}
+
+    key = (config.COLORMAP, config.ALPHA, config.BETA, config.BLEND_MODE, config.HOT_THRESHOLD)
+    engine = engines.get(key)
+    if engine is None:
+        engine = engines[key] = OverlayEngine(config)
+    return engine
+
+# ================= OUTPUT WRITER =================
+OUTPUT_EXTENSIONS = {"jpg": "JPG", "png": "png", "webp": "webp"}
+
+
+def output_path(config: Config, base_name: str) -> Path:
+    """
+    Overlay file for a pair in the configured OUTPUT_FORMAT.
+    """
+    if config.OUTPUT_FORMAT not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unknown OUTPUT_FORMAT: {config.OUTPUT_FORMAT}")
+    return config.OUTPUT_DIR / "output" / f"{base_name}_AT.{OUTPUT_EXTENSIONS[config.OUTPUT_FORMAT]}"
+
+
+def encode_params(config: Config) -> List[int]:
+    """
+    cv2.imwrite flags for the configured OUTPUT_FORMAT.
+    """
+    if config.OUTPUT_FORMAT == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, config.PNG_COMPRESSION]
+    if config.OUTPUT_FORMAT == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, config.WEBP_QUALITY]
+    return [cv2.IMWRITE_JPEG_QUALITY, config.JPEG_QUALITY,
+            cv2.IMWRITE_JPEG_OPTIMIZE, int(config.JPEG_OPTIMIZE),
+            cv2.IMWRITE_JPEG_PROGRESSIVE, int(config.JPEG_PROGRESSIVE)]
+
+
+def write_image(path: Path, image: np.ndarray, params: List[int]) -> bool:
+    """
+    Encodes next to the target and renames it into place, so an interrupted
+    run never leaves a truncated overlay behind (the manifest trusts outputs that exist).
+    """
+    partial_path = path.with_name(f".{path.stem}.part{path.suffix}")
+    if not cv2.imwrite(str(partial_path), image, params):
+        return False
+    os.replace(partial_path, path)
+    return True
+
+
+class OverlayWriter:
+    """
+    Background encode/write stage.
+    A bounded queue drained by writer threads (cv2.imwrite releases the GIL),
+    so the worker moves on to the next pair while the last one is encoded.
+    A full queue blocks the producer instead of buffering frames without limit.
+    """
+
+    def __init__(self, threads: int = 1, queue_size: int = 4):
+        self._queue: "queue.Queue[Optional[Tuple[Path, np.ndarray, List[int]]]]" = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._run, name=f"writer-{i}", daemon=True)
+                         for i in range(max(1, threads))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, path: Path, image: np.ndarray, params: List[int]) -> None:
+        """
+        Queues a frame; the caller must not modify image afterwards.
+        """
+        self._queue.put((path, image, params))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, image, params = item
+                if not write_image(path, image, params):
+                    logger.error(f"[ERR ] Write Failed: {path}")
+            except Exception as e:
+                logger.error(f"[FAIL] Write Exception {item[0]}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def close(self) -> None:
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+_writer: Optional[OverlayWriter] = None
+
+
+def overlay_writer(config: Config) -> OverlayWriter:
+    """
+    This process's writer, flushed when the process exits (incl. pool workers).
+    """
+    global _writer
+    if _writer is None:
+        _writer = OverlayWriter(config.WRITER_THREADS, config.WRITER_QUEUE)
+        multiprocessing.util.Finalize(_writer, _writer.close, exitpriority=10)
+    return _writer
+
+# ================= LAYERED OUTPUT =================
+def sidecar_path(config: Config, base_name: str) -> Path:
+    return config.OUTPUT_DIR / "output" / f"{base_name}_AT.json"
+
+
+def primary_output(config: Config, base_name: str) -> Path:
+    """
+    The file that marks a pair as finished for the configured OUTPUT_MODE.
+    """
+    if config.OUTPUT_MODE == "layered":
+        return sidecar_path(config, base_name)
+    if config.OUTPUT_MODE not in ("baked", "both"):
+        raise ValueError(f"Unknown OUTPUT_MODE: {config.OUTPUT_MODE}")
+    return output_path(config, base_name)
+
+
+def write_layers(config: Config, base_name: str, rgb_path: Path, thermal_path: Path, best_result: dict,
+                 source: str, aligned_thermal: np.ndarray, thermal_shape: Tuple[int, ...]) -> None:
+    """
+    Writes the alignment sidecar and (LAYER_THERMAL) the aligned thermal,
+    cropped to its footprint on the canvas, as a single-channel PNG.
+    """
+    h_rgb, w_rgb = aligned_thermal.shape[:2]
+    matrix = AlignmentEngine.alignment_matrix(best_result, thermal_shape, aligned_thermal.shape)
+
+    layer = None
+    if config.LAYER_THERMAL:
+        # Bounding box of the warped pixels, not the analytic footprint: the
+        # interpolated edge of a rotated, upscaled frame reaches past the corners.
+        # Everything outside is zero, so the crop is lossless.
+        x1, y1, w_box, h_box = cv2.boundingRect(aligned_thermal)
+        x2, y2 = x1 + w_box, y1 + h_box
+        if x2 > x1 and y2 > y1:
+            layer_file = config.OUTPUT_DIR / "output" / f"{base_name}_AL.png"
+            crop = aligned_thermal[y1:y2, x1:x2]
+            params = [cv2.IMWRITE_PNG_COMPRESSION, config.PNG_COMPRESSION]
+            if config.ASYNC_WRITE:
+                with stage("handoff"):
+                    overlay_writer(config).submit(layer_file, crop, params)
+            else:
+                with stage("encode"):
+                    if not write_image(layer_file, crop, params):
+                        raise IOError(f"Write failed: {layer_file}")
+            layer = {"path": layer_file.name, "origin": [int(x1), int(y1)]}
+
+    sidecar = {
+        "version": 1,
+        "name": base_name,
+        "rgb": str(rgb_path.resolve()),
+        "thermal": str(thermal_path.resolve()),
+        "rgb_shape": [h_rgb, w_rgb],
+        "thermal_shape": list(thermal_shape[:2]),
+        "alignment": {
+            "scale": float(best_result["scale"]),
+            "rotation": float(best_result.get("rotation", 0.0)),
+            "start": [int(best_result["loc"][0] - best_result["offset"][0]),
+                      int(best_result["loc"][1] - best_result["offset"][1])],
+            "score": float(best_result["score"])
+        },
+        "matrix": matrix.tolist(),   # Raw thermal px -> RGB px (2x3 affine)
+        "source": source,
+        "layer": layer
+    }
+    path = sidecar_path(config, base_name)
+    partial_path = path.with_name(f".{path.name}.part")
+    with stage("encode"):
+        partial_path.write_text(json.dumps(sidecar, indent=2), encoding="utf-8")
+        os.replace(partial_path, path)
+
+
+def load_aligned_thermal(sidecar: dict, directory: Path) -> np.ndarray:
+    """
+    Aligned thermal on the full RGB canvas, from the layer PNG if there is one,
+    else re-warped from the source thermal frame (e.g. the layer was never flushed).
+    """
+    h_rgb, w_rgb = sidecar["rgb_shape"]
+    layer = sidecar.get("layer")
+    if layer is not None and (directory / layer["path"]).exists():
+        crop = cv2.imread(str(directory / layer["path"]), cv2.IMREAD_GRAYSCALE)
+        if crop is None:
+            raise IOError(f"Read failed: {layer['path']}")
+        aligned = np.zeros((h_rgb, w_rgb), dtype=np.uint8)
+        x, y = layer["origin"]
+        aligned[y:y + crop.shape[0], x:x + crop.shape[1]] = crop
+        return aligned
+
+    thermal_raw = cv2.imread(sidecar["thermal"], cv2.IMREAD_GRAYSCALE)
+    if thermal_raw is None:
+        raise IOError(f"Read failed: {sidecar['thermal']}")
+    alignment = sidecar["alignment"]
+    best_result = {"score": alignment["score"], "scale": alignment["scale"], "rotation": alignment["rotation"],
+                   "loc": tuple(alignment["start"]), "offset": (0, 0)}
+    return AlignmentEngine.apply_alignment(thermal_raw, best_result, (h_rgb, w_rgb))
+
+
+def render_layers(sidecar_file: Path, config: Config, rgb: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Renderer API: the overlay for config's visual settings (ALPHA, BETA,
+    COLORMAP, BLEND_MODE...) from a sidecar, its layer and the source RGB.
+    rgb may be passed in when the caller already has it (it is blended in place).
+    """
+    with open(sidecar_file, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    if rgb is None:
+        rgb = cv2.imread(sidecar["rgb"])
+        if rgb is None:
+            raise IOError(f"Read failed: {sidecar['rgb']}")
+    aligned = load_aligned_thermal(sidecar, sidecar_file.parent)
+    return overlay_engine(config).render(rgb, aligned, out=rgb)
+
+
+def render_sidecar(sidecar_file: Path, config: Optional[Config] = None) -> "PairResult":
+    """
+    Worker function for --render: bakes one sidecar with the current visual settings.
+    """
+    config = config or Config()
+    base_name = sidecar_file.name.replace("_AT.json", "")
+    try:
+        out_path = output_path(config, base_name)
+        if not write_image(out_path, render_layers(sidecar_file, config), encode_params(config)):
+            return PairResult("ERR", base_name, f"Write Failed: {base_name}")
+        return PairResult("OK", base_name, f"Rendered: {base_name}", source="layers", output=str(out_path))
+    except Exception as e:
+        return PairResult("FAIL", base_name, f"Exception {base_name}: {str(e)}")
+
+# ================= CALIBRATION PROFILES =================
+def camera_key(rgb_shape: Tuple[int, ...], thermal_shape: Tuple[int, ...], config: Config) -> str:
+    """
+    Identifies the camera pair a frame came from.
+    Sensor geometry separates camera models; set CAMERA_ID for per-serial profiles.
+    """
+    if config.CAMERA_ID:
+        return config.CAMERA_ID
+    return f"{rgb_shape[1]}x{rgb_shape[0]}+{thermal_shape[1]}x{thermal_shape[0]}"
+
+
+@lru_cache(maxsize=4)
+def load_profile(path: str) -> Dict[str, dict]:
+    """
+    Loads camera profiles as best_result dicts (cached per worker process).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    profiles = {}
+    for key, entry in data.get("cameras", {}).items():
+        profiles[key] = {
+            "score": entry["score"],
+            "scale": entry["scale"],
+            "rotation": entry.get("rotation", 0.0),
+            "loc": tuple(entry["start"]),
+            "offset": (0, 0),
+            "verify_score": entry.get("verify_score")  # None for profiles from older calibrations
+        }
+    return profiles
+
+
+def profile_accepted(score: float, profile: dict, config: Config) -> bool:
+    """
+    Whether a cached profile's verify score is good enough to skip the search.
+    The absolute floor only catches gross failures; a shifted rig still clears
+    it, so the score must also stay within PROFILE_MIN_RATIO of what the rig
+    verified at when the profile was fitted.
+    """
+    reference = profile.get("verify_score")
+    if score < config.PROFILE_MIN_SCORE:
+        return False
+    return reference is None or score >= config.PROFILE_MIN_RATIO * reference
+
+
+def fit_profile(results: List[dict], config: Config) -> Optional[dict]:
+    """
+    Robust global transform from many per-pair search results.
+    Median fit, then MAD outlier rejection and a median re-fit on the inliers.
+    verify_score is the inliers' median verify score, the reference a cached
+    profile is held to at run time (profile_accepted).
+    """
+    samples = np.array([
+        (r["scale"], r.get("rotation", 0.0),
+         r["loc"][0] - r["offset"][0], r["loc"][1] - r["offset"][1], r["score"], r.get("verify", np.nan))
+        for r in results if r["score"] >= config.CALIBRATION_MIN_SCORE
+    ], dtype=np.float64)
+
+    if len(samples) == 0:
+        return None
+
+    median = np.median(samples[:, :4], axis=0)
+    mad = np.median(np.abs(samples[:, :4] - median), axis=0)
+
+    # Tolerance floor: one scale step / 2 px so identical fits are not rejected
+    tolerance = np.maximum(3.0 * 1.4826 * mad, [config.SCALE_STEP, 0.5, 2.0, 2.0])
+    inliers = samples[np.all(np.abs(samples[:, :4] - median) <= tolerance, axis=1)]
+    if len(inliers) == 0:
+        inliers = samples
+
+    scale, rotation, start_x, start_y = np.median(inliers[:, :4], axis=0)
+    verify = inliers[:, 5][~np.isnan(inliers[:, 5])]
+    return {
+        "scale": float(scale),
+        "rotation": float(rotation),
+        "start": [int(round(start_x)), int(round(start_y))],
+        "score": float(np.median(inliers[:, 4])),
+        "verify_score": float(np.median(verify)) if len(verify) else None,
+        "pairs": int(len(samples)),
+        "inliers": int(len(inliers))
+    }
+
+
+def calibration_sample(file_path: Path, config: Optional[Config] = None) -> Optional[Tuple[str, dict]]:
+    """
+    Worker function for calibration: full search on one pair.
+    Returns (camera key, best_result) or None if the pair is unusable.
+    """
+    try:
+        config = config or Config()
+        thermal_path = file_path.parent / file_path.name.replace("_Z.JPG", "_T.JPG")
+
+        rgb = cv2.imread(str(file_path))
+        thermal_raw = cv2.imread(str(thermal_path), cv2.IMREAD_GRAYSCALE)
+        if rgb is None or thermal_raw is None:
+            return None
+
+        result = AlignmentEngine.estimate_alignment(rgb, thermal_raw, config)
+        # What verify_alignment reads for a correct fit on this rig (see profile_accepted)
+        result["verify"] = AlignmentEngine.verify_alignment(rgb, thermal_raw, result)
+        return camera_key(rgb.shape, thermal_raw.shape, config), result
+
+    except Exception as e:
+        logger.error(f"Calibration failed for {file_path.name}: {e}")
+        return None
+
+
+def calibrate(rgb_files: List[Path], config: Config, profile_path: Path) -> Dict[str, dict]:
+    """
+    Runs the search over a batch and writes one robust transform per camera.
+    """
+    config = plan_execution(config, len(rgb_files))
+    with ProcessPoolExecutor(max_workers=config.MAX_WORKERS, initializer=init_worker,
+                             initargs=(config.CV_THREADS,)) as executor:
+        worker = partial(calibration_sample, config=config)
+        samples = list(tqdm(executor.map(worker, rgb_files, chunksize=config.CHUNKSIZE),
+                            total=len(rgb_files), unit="img"))
+
+    grouped: Dict[str, List[dict]] = {}
+    for sample in samples:
+        if sample is not None:
+            grouped.setdefault(sample[0], []).append(sample[1])
+
+    cameras = {}
+    for key, results in grouped.items():
+        fit = fit_profile(results, config)
+        if fit is None:
+            logger.warning(f"[{key}] No pair above CALIBRATION_MIN_SCORE, camera skipped")
+            continue
+        cameras[key] = fit
+        logger.info(f"[{key}] scale={fit['scale']:.4f} start={fit['start']} "
+                    f"inliers={fit['inliers']}/{fit['pairs']} score={fit['score']:.2f}")
+
+    profile_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(profile_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "cameras": cameras}, f, indent=2)
+
+    return cameras
 
 # ================= WORKER FUNCTION =================
-def process_single_pair(file_path: Path) -> str:
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def decode_for_search(file_path: Path, reduction: int, rgb: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+    """
+    Image used by the alignment search.
+    Reductions 2/4/8 use libjpeg's DCT-domain downscaled grayscale decode;
+    an already decoded full-res image is downsampled in memory instead.
+    """
+    if reduction == 1:
+        return rgb if rgb is not None else cv2.imread(str(file_path))
+    if reduction not in REDUCED_DECODE_FLAGS:
+        raise ValueError(f"SEARCH_DECODE_REDUCTION must be 1, 2, 4 or 8, got {reduction}")
+
+    if rgb is not None:
+        h, w = rgb.shape[:2]
+        gray = cv2.cvtColor(rgb, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (-(-w // reduction), -(-h // reduction)), interpolation=cv2.INTER_AREA)
+    return cv2.imread(str(file_path), REDUCED_DECODE_FLAGS[reduction])
+
+
+@dataclass
+class PairResult:
+    """Outcome of one pair, returned by the worker (one JSONL metrics record)."""
+    status: str                     # "OK" | "DONE" (unchanged) | "SKIP" | "ERR" | "FAIL" | "RETRY"
+    name: str
+    message: str
+    score: Optional[float] = None
+    tier: int = 1
+    source: str = ""                # "search" | "profile" | "manifest"
+    scale: Optional[float] = None
+    offset: Optional[Tuple[int, int]] = None   # Thermal top-left on the RGB canvas (px)
+    rotation: float = 0.0                      # Degrees (fourier backend / profiles)
+    timings: Dict[str, float] = field(default_factory=dict)
+    peak_rss_mb: Optional[float] = None
+    inputs: Optional[Dict[str, dict]] = None   # Size / mtime / hash per input file (manifest)
+    output: Optional[str] = None
+
+    def __str__(self) -> str:
+        return f"[{self.status:<4}] {self.message}"
+
+
+def process_single_pair(file_path: Path, config: Optional[Config] = None,
+                        retry_below: Optional[float] = None, tier: int = 1,
+                        cached: Optional[dict] = None) -> PairResult:
     """
     Worker function for Multiprocessing.
-    Returns status string.
+    With retry_below set, a weaker match is not written and comes back as RETRY.
+    With a cached manifest entry and unchanged inputs, the search is skipped.
+    The result carries per-stage timings and the process's peak RSS.
     """
+    global _active_timer
+    config = config or Config() # Load defaults
+    base_name = file_path.name.replace("_Z.JPG", "")
+
+    timer = StageTimer()
+    _active_timer = timer
+    start = time.perf_counter()
+    try:
+        with maybe_profile(config, base_name):
+            result = _run_pair(file_path, base_name, config, retry_below, tier, cached)
+    finally:
+        _active_timer = None
+
+    result.timings = dict(timer.totals, total=time.perf_counter() - start)
+    result.peak_rss_mb = peak_rss_mb()
+    return result
+
+
+def _run_pair(file_path: Path, base_name: str, config: Config,
+              retry_below: Optional[float], tier: int, cached: Optional[dict]) -> PairResult:
     try:
-        config = Config() # Load defaults
-        
         # Path Management
-        base_name = file_path.name.replace("_Z.JPG", "")
         thermal_name = base_name + "_T.JPG"
         thermal_path = file_path.parent / thermal_name
+        out_path = primary_output(config, base_name)
         
         if not thermal_path.exists():
-            return f"[SKIP] Missing Thermal: {base_name}"
+            return PairResult("SKIP", base_name, f"Missing Thermal: {base_name}", tier=tier)
+
+        # Manifest: identical inputs -> nothing to do, or re-render from the cached alignment
+        inputs = None
+        if config.MANIFEST:
+            with stage("hash"):
+                inputs = {"rgb": input_record(file_path), "thermal": input_record(thermal_path)}
+        reuse = cached is not None and inputs is not None and same_inputs(inputs, cached["inputs"])
+        if reuse and cached["render_ok"]:
+            return cached_result(cached, "DONE", f"Unchanged: {base_name}", inputs=inputs, tier=tier)
             
-        # Read Images
-        rgb = cv2.imread(str(file_path))
-        thermal_raw = cv2.imread(str(thermal_path), cv2.IMREAD_GRAYSCALE)
+        # Read Images (full-res RGB is only decoded when the overlay needs it)
+        with stage("decode"):
+            thermal_raw = cv2.imread(str(thermal_path), cv2.IMREAD_GRAYSCALE)
+        rgb = None
         
-        if rgb is None or thermal_raw is None:
-            return f"[ERR ] Read Failed: {base_name}"
+        if thermal_raw is None:
+            return PairResult("ERR", base_name, f"Read Failed: {base_name}", tier=tier)
             
         # --- PIPELINE EXECUTION ---
         engine = AlignmentEngine()
         
-        # 1. Alignment
-        aligned_gray = engine.find_optimal_alignment(rgb, thermal_raw, config)
-        
-        # 2. Overlay
-        final_result = engine.create_smart_overlay(rgb, aligned_gray, config)
+        # 1. Alignment (cached result, calibrated warp, search as fallback)
+        best_result = None
+        source = "search"
+        if reuse:
+            best_result, source = cached_alignment(cached), "manifest"
+
+        if best_result is None and config.PROFILE_PATH is not None:
+            with stage("decode"):
+                rgb = cv2.imread(str(file_path))
+            if rgb is None:
+                return PairResult("ERR", base_name, f"Read Failed: {base_name}", tier=tier)
+
+            profile = load_profile(str(config.PROFILE_PATH)).get(camera_key(rgb.shape, thermal_raw.shape, config))
+            if profile is not None:
+                with stage("match"):
+                    score = engine.verify_alignment(rgb, thermal_raw, profile)
+                if profile_accepted(score, profile, config):
+                    best_result = {key: val for key, val in profile.items() if key != "verify_score"}
+                    best_result["score"], source = score, "profile"
+
+        if best_result is None:
+            with stage("decode"):
+                rgb_search = decode_for_search(file_path, config.SEARCH_DECODE_REDUCTION, rgb)
+            if rgb_search is None:
+                return PairResult("ERR", base_name, f"Read Failed: {base_name}", tier=tier)
+
+            best_result = engine.estimate_alignment(rgb_search, thermal_raw, config)
+            if retry_below is not None and best_result["score"] < retry_below:
+                return PairResult("RETRY", base_name, f"Low confidence ({best_result['score']:.2f}): {base_name}",
+                                  score=best_result["score"], tier=tier, source=source,
+                                  scale=float(best_result["scale"]))
+
+            if rgb is None and config.SEARCH_DECODE_REDUCTION == 1:
+                # The search already decoded the full-res image
+                rgb = rgb_search
+            elif rgb is None:
+                with stage("decode"):
+                    rgb = cv2.imread(str(file_path))
+                if rgb is None:
+                    return PairResult("ERR", base_name, f"Read Failed: {base_name}", tier=tier)
+
+            # Search ran on a reduced image: bring the transform back to full-res
+            if rgb_search.shape[1] != rgb.shape[1]:
+                best_result = engine.scale_result(best_result, rgb.shape[1] / rgb_search.shape[1])
+            del rgb_search
+
+        if rgb is None:
+            with stage("decode"):
+                rgb = cv2.imread(str(file_path))
+            if rgb is None:
+                return PairResult("ERR", base_name, f"Read Failed: {base_name}", tier=tier)
+
+        with stage("reconstruct"):
+            aligned_gray = engine.apply_alignment(thermal_raw, best_result, rgb.shape)
+
+        # 2. Layers (sidecar + aligned thermal: any blend can be rendered from them later)
+        if config.OUTPUT_MODE in ("layered", "both"):
+            write_layers(config, base_name, file_path, thermal_path, best_result, source,
+                         aligned_gray, thermal_raw.shape)
         
-        # 3. Save
-        output_path = config.OUTPUT_DIR / "output" / f"{base_name}_AT.JPG"
-        cv2.imwrite(str(output_path), final_result)
+        if config.OUTPUT_MODE != "layered":
+            # 3. Overlay
+            with stage("overlay"):
+                final_result = overlay_engine(config).render(rgb, aligned_gray, out=rgb)
+
+            # 4. Save (async: only the hand-off to the writer is on this path)
+            if config.ASYNC_WRITE:
+                with stage("handoff"):
+                    overlay_writer(config).submit(out_path, final_result, encode_params(config))
+            else:
+                with stage("encode"):
+                    written = write_image(out_path, final_result, encode_params(config))
+                if not written:
+                    return PairResult("ERR", base_name, f"Write Failed: {base_name}", tier=tier)
         
-        return f"[OK  ] Processed: {base_name}"
+        start_x = int(best_result["loc"][0] - best_result["offset"][0])
+        start_y = int(best_result["loc"][1] - best_result["offset"][1])
+        return PairResult("OK", base_name, f"Processed: {base_name} ({source})",
+                          score=float(best_result["score"]), tier=tier, source=source,
+                          scale=float(best_result["scale"]), offset=(start_x, start_y),
+                          rotation=float(best_result.get("rotation", 0.0)),
+                          inputs=inputs, output=str(out_path))
 
     except Exception as e:
-        return f"[FAIL] Exception {base_name}: {str(e)}"
+        return PairResult("FAIL", base_name, f"Exception {base_name}: {str(e)}", tier=tier)
+
+# ================= RUN MANIFEST =================
+# Config fields behind the alignment vs. fields that only change the rendered overlay
+ALIGNMENT_FIELDS = ("BACKEND", "SCALE_RANGE", "SCALE_STEP", "SEARCH_STRATEGY", "PYRAMID_LEVELS",
+                    "PYRAMID_RADIUS", "PYRAMID_MIN_SIZE", "PYRAMID_CANDIDATES", "GOLDEN_PROBES",
+                    "GOLDEN_EXIT_SCORE", "FOURIER_SIZE", "SEARCH_DECODE_REDUCTION", "PROFILE_PATH",
+                    "CAMERA_ID", "PROFILE_MIN_SCORE", "PROFILE_MIN_RATIO", "TWO_TIER", "NARROW_SCALE_RANGE",
+                    "NARROW_SCALE_STEP", "WIDE_SCALE_RANGE", "WIDE_SCALE_STEP", "RETRY_SCORE")
+RENDER_FIELDS = ("ALPHA", "BETA", "COLORMAP", "BLEND_MODE", "HOT_THRESHOLD", "OUTPUT_MODE", "LAYER_THERMAL",
+                 "OUTPUT_FORMAT", "JPEG_QUALITY", "JPEG_OPTIMIZE", "JPEG_PROGRESSIVE", "PNG_COMPRESSION",
+                 "WEBP_QUALITY")
+
+
+def config_fingerprint(config: Config, fields: Tuple[str, ...]) -> str:
+    """
+    Short stable hash of the given Config fields.
+    """
+    values = json.dumps({name: getattr(config, name) for name in fields}, sort_keys=True, default=str)
+    return hashlib.blake2b(values.encode(), digest_size=8).hexdigest()
+
+
+def input_record(path: Path, chunk_size: int = 1 << 20) -> dict:
+    """
+    Size, mtime and content hash of one input file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest.hexdigest()}
+
+
+def same_inputs(current: Dict[str, dict], recorded: Dict[str, dict]) -> bool:
+    return all(current[key]["digest"] == recorded[key]["digest"] for key in current)
+
+
+def cached_alignment(entry: dict) -> dict:
+    """
+    Manifest alignment as a best_result dict (same layout as calibration profiles).
+    """
+    alignment = entry["alignment"]
+    return {
+        "score": alignment["score"],
+        "scale": alignment["scale"],
+        "rotation": alignment["rotation"],
+        "loc": tuple(alignment["start"]),
+        "offset": (0, 0)
+    }
+
+
+def cached_result(entry: dict, status: str, message: str, **kwargs) -> PairResult:
+    alignment = entry["alignment"]
+    return PairResult(status, entry["name"], message, score=alignment["score"], source="manifest",
+                      scale=alignment["scale"], offset=tuple(alignment["start"]),
+                      rotation=alignment["rotation"], output=entry["output"], **kwargs)
+
+
+def manifest_path(config: Config) -> Path:
+    return config.MANIFEST_PATH or config.OUTPUT_DIR / "run_manifest.jsonl"
+
+
+class RunManifest:
+    """
+    Append-only JSONL log of finished pairs; the last entry per pair wins.
+    Each entry is flushed as soon as its pair completes, so a crashed run
+    resumes after the last finished pair (a truncated last line is ignored).
+    """
+
+    def __init__(self, path: Path, config: Config):
+        self.path = path
+        self.config = config
+        self.alignment_key = config_fingerprint(config, ALIGNMENT_FIELDS)
+        self.render_key = config_fingerprint(config, RENDER_FIELDS)
+        self.entries: Dict[str, dict] = {}
+        if path.exists() and not config.FORCE_RERUN:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["name"]] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def plan(self, file_path: Path) -> Tuple[bool, Optional[dict]]:
+        """
+        (skip, cached entry) for a pair.
+        Skips without reading the inputs when size and mtime still match;
+        otherwise the worker hashes them and reuses the entry if the content did not change.
+        """
+        base_name = file_path.name.replace("_Z.JPG", "")
+        entry = self.entries.get(base_name)
+        if entry is None or entry["alignment_key"] != self.alignment_key:
+            return False, None
+
+        out_path = primary_output(self.config, base_name)
+        render_ok = (entry["render_key"] == self.render_key and
+                     entry["output"] == str(out_path) and out_path.exists())
+        cached = dict(entry, render_ok=render_ok)
+
+        thermal_path = file_path.parent / f"{base_name}_T.JPG"
+        try:
+            stats = {"rgb": file_path.stat(), "thermal": thermal_path.stat()}
+        except FileNotFoundError:
+            return False, cached
+        touched = any((stat.st_size, stat.st_mtime_ns) !=
+                      (entry["inputs"][key]["size"], entry["inputs"][key]["mtime_ns"])
+                      for key, stat in stats.items())
+        return render_ok and not touched, cached
+
+    def record(self, result: PairResult) -> None:
+        if result.status not in ("OK", "DONE") or result.inputs is None:
+            return
+        entry = {
+            "name": result.name,
+            "inputs": result.inputs,
+            "alignment_key": self.alignment_key,
+            "render_key": self.render_key,
+            "alignment": {"scale": result.scale, "rotation": result.rotation,
+                          "start": list(result.offset), "score": result.score},
+            "source": result.source,
+            "output": result.output
+        }
+        self.entries[result.name] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+# ================= SCHEDULER =================
+def tier_config(config: Config, tier: int) -> Config:
+    """
+    Search window for a tier: 1 = narrow/coarse, 2 = wide/fine.
+    """
+    if tier == 1:
+        return replace(config, SCALE_RANGE=config.NARROW_SCALE_RANGE, SCALE_STEP=config.NARROW_SCALE_STEP)
+    return replace(config, SCALE_RANGE=config.WIDE_SCALE_RANGE, SCALE_STEP=config.WIDE_SCALE_STEP)
+
+
+def run_batch(rgb_files: List[Path], config: Config, executor: Optional[ProcessPoolExecutor] = None,
+              on_result: Optional[Callable[[PairResult], None]] = None, progress: bool = True) -> List[PairResult]:
+    """
+    Runs all pairs through the pool (a new one, or the given warm executor).
+    With TWO_TIER, every pair gets the narrow search first; pairs scoring
+    below RETRY_SCORE are queued and re-searched wide after the main batch.
+    With MANIFEST, unchanged pairs are skipped and finished ones recorded as they complete.
+    on_result is called with every final result as soon as it is available.
+    """
+    config = plan_execution(config, len(rgb_files))
+    manifest = RunManifest(manifest_path(config), config) if config.MANIFEST else None
+
+    results: List[Optional[PairResult]] = [None] * len(rgb_files)
+    cached: List[Optional[dict]] = [None] * len(rgb_files)
+    todo = []
+    for i, path in enumerate(rgb_files):
+        skip, entry = manifest.plan(path) if manifest is not None else (False, None)
+        if skip:
+            results[i] = cached_result(entry, "DONE", f"Unchanged: {entry['name']}")
+            if on_result is not None:
+                on_result(results[i])
+        else:
+            cached[i] = entry
+            todo.append(i)
+    if len(todo) < len(rgb_files):
+        logger.info(f"Manifest: {len(rgb_files) - len(todo)} unchanged pair(s) skipped")
+
+    def collect(indices: List[int], tier: int, retry_below: Optional[float], desc: Optional[str]) -> None:
+        files = [rgb_files[i] for i in indices]
+        entries = [cached[i] if tier == 1 else None for i in indices]
+        tier_cfg = tier_config(config, tier) if config.TWO_TIER else config
+        mapped = executor.map(process_single_pair, files, repeat(tier_cfg), repeat(retry_below),
+                              repeat(tier), entries, chunksize=config.CHUNKSIZE)
+        for i, res in zip(indices, tqdm(mapped, total=len(indices), unit="img", desc=desc, disable=not progress)):
+            results[i] = res
+            if manifest is not None:
+                manifest.record(res)
+            if on_result is not None and res.status != "RETRY":
+                on_result(res)
+
+    if executor is not None:
+        pool = nullcontext(executor)
+    else:
+        pool = ProcessPoolExecutor(max_workers=config.MAX_WORKERS, initializer=init_worker,
+                                   initargs=(config.CV_THREADS,))
+    try:
+        with pool as executor:
+            if not config.TWO_TIER:
+                collect(todo, 1, None, None)
+                return results
+
+            # Tier 1: cheap pass, low scores are held back
+            collect(todo, 1, config.RETRY_SCORE, "Tier 1")
+
+            # Tier 2: wide re-search queue
+            retry_idx = [i for i in todo if results[i].status == "RETRY"]
+            if retry_idx:
+                logger.info(f"Re-searching {len(retry_idx)} low-confidence pair(s) with the wide window...")
+                collect(retry_idx, 2, None, "Tier 2")
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    return results
+
+# ================= STREAMING INGEST =================
+class PairWatcher:
+    """
+    Polls a directory and reports _Z/_T pairs once both files are complete.
+    A file counts as complete when its size and mtime did not change
+    between two polls (drone offloads land file by file).
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._stat: Dict[Path, Tuple[int, float]] = {}
+        self._stable: set = set()
+        self._emitted: set = set()
+
+    def poll(self) -> List[Path]:
+        current = {}
+        for path in list(self.directory.glob("*_Z.JPG")) + list(self.directory.glob("*_T.JPG")):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime)
+
+        self._stable = {path for path, sig in current.items() if self._stat.get(path) == sig}
+        self._stat = current
+
+        ready = []
+        for path in sorted(self._stable):
+            if not path.name.endswith("_Z.JPG") or path in self._emitted:
+                continue
+            # The _T partner may still be in flight: wait for it
+            if path.parent / path.name.replace("_Z.JPG", "_T.JPG") in self._stable:
+                self._emitted.add(path)
+                ready.append(path)
+        return ready
+
+
+def run_watch(config: Config) -> List[PairResult]:
+    """
+    Long-running streaming mode.
+    New pairs go to the pool as soon as both files are complete; at most
+    WATCH_QUEUE pairs are in flight and polling pauses while the queue is
+    full (backpressure). Pairs already in the manifest (or, without one,
+    whose overlay exists) are skipped.
+    """
+    config = plan_execution(config, os.cpu_count() or 1)
+    max_inflight = config.WATCH_QUEUE or 2 * config.MAX_WORKERS
+    manifest = RunManifest(manifest_path(config), config) if config.MANIFEST else None
+
+    watcher = PairWatcher(config.INPUT_DIR)
+    pending: deque = deque()   # (rgb path, tier, cached manifest entry)
+    inflight: dict = {}        # future -> (rgb path, tier)
+    results: List[PairResult] = []
+    last_activity = time.monotonic()
+
+    logger.info(f"Watching {config.INPUT_DIR} (max {max_inflight} pair(s) in flight)...")
+    with ProcessPoolExecutor(max_workers=config.MAX_WORKERS, initializer=init_worker,
+                             initargs=(config.CV_THREADS,)) as executor:
+        try:
+            while True:
+                # Backpressure: only look for new work while there is room for it
+                if len(pending) + len(inflight) < max_inflight:
+                    for path in watcher.poll():
+                        if manifest is not None:
+                            skip, entry = manifest.plan(path)
+                        else:
+                            skip = primary_output(config, path.name.replace("_Z.JPG", "")).exists()
+                            entry = None
+                        if not skip:
+                            pending.append((path, 1, entry))
+
+                while pending and len(inflight) < max_inflight:
+                    path, tier, entry = pending.popleft()
+                    if config.TWO_TIER:
+                        future = executor.submit(process_single_pair, path, tier_config(config, tier),
+                                                 config.RETRY_SCORE if tier == 1 else None, tier, entry)
+                    else:
+                        future = executor.submit(process_single_pair, path, config, cached=entry)
+                    inflight[future] = (path, tier)
+
+                if not inflight:
+                    if config.WATCH_IDLE_EXIT and time.monotonic() - last_activity > config.WATCH_IDLE_EXIT:
+                        break
+                    time.sleep(config.WATCH_INTERVAL)
+                    continue
+
+                done, _ = wait(inflight, timeout=config.WATCH_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, tier = inflight.pop(future)
+                    res = future.result()
+                    last_activity = time.monotonic()
+
+                    if res.status == "RETRY":
+                        # Wide re-search goes to the back of the queue
+                        pending.append((path, 2, None))
+                        continue
+
+                    results.append(res)
+                    write_metrics([res], metrics_path(config))
+                    if manifest is not None:
+                        manifest.record(res)
+                    if res.status in ("FAIL", "ERR"):
+                        logger.error(res)
+                    elif res.status == "SKIP":
+                        logger.warning(res)
+                    else:
+                        logger.info(res)
+
+        except KeyboardInterrupt:
+            logger.info("Stopping watch mode, finishing pairs in flight...")
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    return results
 
 # ================= MAIN ENTRY POINT =================
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RGB / Thermal overlay pipeline")
+    parser.add_argument("--input-dir", type=Path, help="Override Config.INPUT_DIR")
+    parser.add_argument("--output-dir", type=Path, help="Override Config.OUTPUT_DIR")
+    parser.add_argument("--profile", type=Path, help="Camera calibration profile (JSON)")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Fit per-camera profiles over the input batch and write --profile")
+    parser.add_argument("--two-tier", action="store_true",
+                        help="Narrow search for all pairs, wide re-search for low-confidence ones")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and process pairs as they land in the input directory")
+    parser.add_argument("--idle-exit", type=float, help="Watch mode: exit after this many idle seconds")
+    parser.add_argument("--layered", action="store_true",
+                        help="Write alignment sidecars + aligned thermal layers instead of baked overlays")
+    parser.add_argument("--render", action="store_true",
+                        help="Bake overlays from existing sidecars in OUTPUT_DIR (no alignment)")
+    parser.add_argument("--force", action="store_true",
+                        help="Reprocess every pair, ignoring the run manifest")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+
     # Setup Directories
     cfg = Config()
+    if args.input_dir:
+        cfg = replace(cfg, INPUT_DIR=args.input_dir)
+    if args.output_dir:
+        cfg = replace(cfg, OUTPUT_DIR=args.output_dir)
     (cfg.OUTPUT_DIR / "output").mkdir(parents=True, exist_ok=True)
     
     # Gather Files
     rgb_files = [f for f in cfg.INPUT_DIR.glob("*_Z.JPG")]
+
+    if args.calibrate:
+        profile_path = args.profile or cfg.OUTPUT_DIR / "camera_profile.json"
+        logger.info(f"Calibrating on {len(rgb_files)} image pairs...")
+        cameras = calibrate(rgb_files, cfg, profile_path)
+        logger.info(f"Profile for {len(cameras)} camera(s) saved to: {profile_path}")
+        raise SystemExit(0)
+
+    if args.profile:
+        cfg = replace(cfg, PROFILE_PATH=args.profile)
+    if args.two_tier:
+        cfg = replace(cfg, TWO_TIER=True)
+    if args.idle_exit is not None:
+        cfg = replace(cfg, WATCH_IDLE_EXIT=args.idle_exit)
+    if args.force:
+        cfg = replace(cfg, FORCE_RERUN=True)
+    if args.layered:
+        cfg = replace(cfg, OUTPUT_MODE="layered")
+
+    if args.render:
+        sidecars = sorted((cfg.OUTPUT_DIR / "output").glob("*_AT.json"))
+        logger.info(f"Rendering {len(sidecars)} overlay(s) from sidecars...")
+        plan = plan_execution(cfg, len(sidecars))
+        with ProcessPoolExecutor(max_workers=plan.MAX_WORKERS, initializer=init_worker,
+                                 initargs=(plan.CV_THREADS,)) as executor:
+            rendered = list(tqdm(executor.map(partial(render_sidecar, config=plan), sidecars,
+                                              chunksize=plan.CHUNKSIZE), total=len(sidecars), unit="img"))
+        for res in rendered:
+            if res.status != "OK":
+                logger.error(res)
+        logger.info(f"Rendered {sum(res.status == 'OK' for res in rendered)} overlay(s) to: {cfg.OUTPUT_DIR}")
+        raise SystemExit(0)
+
+    if args.watch:
+        results = run_watch(cfg)
+        log_stage_report([res for res in results if res.status == "OK"])
+        logger.info(f"Watch mode processed {sum(res.status == 'OK' for res in results)} pair(s). "
+                    f"Output saved to: {cfg.OUTPUT_DIR}")
+        raise SystemExit(0)
     
     logger.info(f"Starting pipeline on {len(rgb_files)} image pairs...")
-    logger.info(f"Using {cfg.MAX_WORKERS} CPU cores.")
+    plan = plan_execution(cfg, len(rgb_files))
+    logger.info(f"Using {plan.MAX_WORKERS} process(es) x {plan.SCALE_THREADS} scale thread(s), "
+                f"{plan.CV_THREADS} OpenCV thread(s) each, chunksize {plan.CHUNKSIZE}.")
     
     # Run Parallel Processing
-    with ProcessPoolExecutor(max_workers=cfg.MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(process_single_pair, rgb_files), total=len(rgb_files), unit="img"))
+    results = run_batch(rgb_files, cfg)
         
     # Final Report
     logger.info("--- Processing Summary ---")
     for res in results:
-        if "[FAIL]" in res or "[ERR ]" in res:
+        if res.status in ("FAIL", "ERR"):
             logger.error(res)
-        elif "[SKIP]" in res:
+        elif res.status == "SKIP":
             logger.warning(res)
+        elif res.status == "OK" and res.score is not None and res.score < cfg.RETRY_SCORE:
+            logger.warning(f"[WARNING] {res.name}: Low alignment confidence ({res.score:.2f})")
+
+    done = [res for res in results if res.status == "OK"]
+    if cfg.MANIFEST:
+        logger.info(f"Unchanged: {sum(res.status == 'DONE' for res in results)} pair(s), "
+                    f"re-rendered from cached alignment: {sum(res.source == 'manifest' for res in done)} pair(s)")
+    if cfg.TWO_TIER:
+        logger.info(f"Tier 1 (narrow): {sum(res.tier == 1 for res in done)} pair(s), "
+                    f"Tier 2 (wide): {sum(res.tier == 2 for res in done)} pair(s)")
+
+    write_metrics([res for res in results if res.status != "DONE"], metrics_path(cfg))
+    log_stage_report(done)
+    logger.info(f"Per-pair metrics appended to: {metrics_path(cfg)}")
             
     logger.info(f"Output saved to: {cfg.OUTPUT_DIR}")
\ No newline at end of file
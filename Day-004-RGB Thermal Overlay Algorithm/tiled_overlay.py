@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+"""
+Tiled, out-of-core RGB / Thermal overlay for stitched orthomosaics.
+
+Neither mosaic is ever held in memory as a whole:
+  1. Both inputs are opened for windowed reads (.npy via positioned reads,
+     GeoTIFF & co. via rasterio when it is installed).
+  2. The alignment search runs on a downsampled overview (OVERVIEW_SIZE).
+  3. A first pass over the aligned thermal collects the CLAHE cell histograms
+     of the whole canvas, so every tile shares one contrast mapping.
+  4. The overlay is rendered tile by tile (TILE_SIZE) and each tile is
+     written to the output as soon as it is done.
+
+Peak memory depends on TILE_SIZE / OVERVIEW_SIZE, not on the mosaic size.
+
+    python tiled_overlay.py rgb_mosaic.npy thermal_mosaic.npy -o overlay.npy
+    python tiled_overlay.py rgb.tif thermal.tif -o overlay.tif --tile 4096   # needs rasterio
+"""
+import argparse
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from task_1_code import AlignmentEngine, Config, OverlayEngine, logger, peak_rss_mb
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+STRIP_BYTES = 64 * 1024 * 1024  # Read budget per strip while building an overview
+
+
+# ================= RASTER I/O =================
+class RasterSource:
+    """
+    Windowed read access to a large image (H x W or H x W x C, uint8, BGR order).
+    """
+    shape: Tuple[int, ...]
+
+    def read(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def read_gray(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        window = self.read(x, y, w, h)
+        return cv2.cvtColor(window, cv2.COLOR_BGR2GRAY) if window.ndim == 3 else window
+
+    def overview(self, max_side: int, gray: bool = False) -> Tuple[np.ndarray, int]:
+        """
+        Downsampled copy with the longest side <= max_side, and its integer factor.
+        Built strip by strip with INTER_AREA, so it never reads more than STRIP_BYTES at once.
+        """
+        h, w = self.shape[:2]
+        factor = max(1, -(-max(h, w) // max_side))
+        out_w, out_h = max(1, w // factor), max(1, h // factor)
+
+        row_bytes = w * (self.shape[2] if len(self.shape) == 3 else 1)
+        rows = max(1, STRIP_BYTES // (row_bytes * factor)) * factor
+        parts = []
+        for y in range(0, out_h * factor, rows):
+            strip_h = min(rows, out_h * factor - y)
+            strip = self.read_gray(0, y, out_w * factor, strip_h) if gray else self.read(0, y, out_w * factor, strip_h)
+            parts.append(cv2.resize(strip, (out_w, strip_h // factor), interpolation=cv2.INTER_AREA))
+        return np.concatenate(parts, axis=0), factor
+
+    def close(self) -> None:
+        pass
+
+
+class NpySource(RasterSource):
+    """
+    .npy array read with positioned reads (header parsed by numpy, no mapping),
+    so resident memory does not grow with the number of pages touched.
+    """
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        version = np.lib.format.read_magic(self._file)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(self._file)
+        if fortran_order or dtype != np.uint8 or len(shape) not in (2, 3):
+            raise ValueError(f"{path}: expected a C-ordered uint8 H x W (x C) array")
+        self.shape = shape
+        self._offset = self._file.tell()
+        self._pixel = shape[2] if len(shape) == 3 else 1
+
+    def read(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        out = np.empty((h, w) + self.shape[2:], dtype=np.uint8)
+        row_bytes = self.shape[1] * self._pixel
+        for row in range(h):
+            self._file.seek(self._offset + (y + row) * row_bytes + x * self._pixel)
+            self._file.readinto(memoryview(out[row]).cast("B"))
+        return out
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class RasterioSource(RasterSource):
+    """
+    Any GDAL raster (GeoTIFF, BigTIFF, VRT...) through rasterio windows.
+    """
+
+    def __init__(self, path: Path):
+        self.dataset = rasterio.open(path)
+        self._bands = [1, 2, 3] if self.dataset.count >= 3 else [1]
+        self.shape = (self.dataset.height, self.dataset.width) + ((3,) if len(self._bands) == 3 else ())
+
+    def read(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        data = self.dataset.read(self._bands, window=Window(x, y, w, h)).astype(np.uint8, copy=False)
+        if len(self._bands) == 1:
+            return data[0]
+        # Bands are RGB, the pipeline works in BGR
+        return np.ascontiguousarray(data[::-1].transpose(1, 2, 0))
+
+    def close(self) -> None:
+        self.dataset.close()
+
+
+class ImageSource(RasterSource):
+    """
+    Fallback for formats only OpenCV can read: decodes the whole image (not out-of-core).
+    """
+
+    def __init__(self, path: Path):
+        self.image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+        if self.image is None:
+            raise ValueError(f"Cannot read {path}")
+        if self.image.ndim == 3 and self.image.shape[2] == 4:
+            self.image = cv2.cvtColor(self.image, cv2.COLOR_BGRA2BGR)
+        self.shape = self.image.shape
+        logger.warning(f"{path.name}: no windowed reader for this format, decoded in full")
+
+    def read(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        return self.image[y:y + h, x:x + w]
+
+
+def open_raster(path: Path) -> RasterSource:
+    if path.suffix.lower() == ".npy":
+        return NpySource(path)
+    if rasterio is not None:
+        return RasterioSource(path)
+    return ImageSource(path)
+
+
+class RasterSink:
+    """
+    Incrementally written H x W x 3 output.
+    """
+
+    def write(self, x: int, y: int, tile: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class NpySink(RasterSink):
+    """
+    .npy output: header + full-size file from open_memmap, then positioned writes per tile row.
+    """
+
+    def __init__(self, path: Path, shape: Tuple[int, int, int]):
+        header = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape)
+        self._offset = header.offset
+        del header
+        self.shape = shape
+        self._file = open(path, "r+b")
+
+    def write(self, x: int, y: int, tile: np.ndarray) -> None:
+        row_bytes = self.shape[1] * 3
+        for row in range(tile.shape[0]):
+            self._file.seek(self._offset + (y + row) * row_bytes + x * 3)
+            self._file.write(np.ascontiguousarray(tile[row]).data)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class RasterioSink(RasterSink):
+    """
+    Tiled, compressed GeoTIFF; georeferencing is copied from the RGB mosaic when it has one.
+    """
+
+    def __init__(self, path: Path, shape: Tuple[int, int, int], like: Optional[RasterSource] = None):
+        profile = {"driver": "GTiff", "height": shape[0], "width": shape[1], "count": 3,
+                   "dtype": "uint8", "tiled": True, "blockxsize": 512, "blockysize": 512,
+                   "compress": "deflate", "BIGTIFF": "IF_SAFER"}
+        if isinstance(like, RasterioSource):
+            profile.update(crs=like.dataset.crs, transform=like.dataset.transform)
+        self.dataset = rasterio.open(path, "w", **profile)
+
+    def write(self, x: int, y: int, tile: np.ndarray) -> None:
+        self.dataset.write(tile[:, :, ::-1].transpose(2, 0, 1), window=Window(x, y, tile.shape[1], tile.shape[0]))
+
+    def close(self) -> None:
+        self.dataset.close()
+
+
+def open_sink(path: Path, shape: Tuple[int, int, int], like: Optional[RasterSource] = None) -> RasterSink:
+    if path.suffix.lower() == ".npy":
+        return NpySink(path, shape)
+    if rasterio is None:
+        raise ValueError(f"Writing {path.suffix} needs rasterio; use a .npy output instead")
+    return RasterioSink(path, shape, like)
+
+# ================= ALIGNMENT =================
+def overview_alignment(rgb: RasterSource, thermal: RasterSource, config: Config) -> dict:
+    """
+    Runs the configured search on overviews of both mosaics and returns the
+    best_result in full-resolution RGB pixels.
+    """
+    rgb_small, factor = rgb.overview(config.OVERVIEW_SIZE)
+    thermal_small, _ = thermal.overview(config.OVERVIEW_SIZE, gray=True)
+    logger.info(f"Overview {rgb_small.shape[1]}x{rgb_small.shape[0]} (1/{factor}), "
+                f"thermal {thermal_small.shape[1]}x{thermal_small.shape[0]}")
+
+    best_result = AlignmentEngine.estimate_alignment(rgb_small, thermal_small, config)
+    return AlignmentEngine.scale_result(best_result, rgb.shape[1] / rgb_small.shape[1])
+
+
+def warp_tile(thermal: RasterSource, matrix: np.ndarray, x: int, y: int, w: int, h: int) -> np.ndarray:
+    """
+    Aligned thermal for one canvas window, reading only the thermal pixels it covers.
+    matrix maps full thermal pixels onto the full RGB canvas (alignment_matrix).
+    """
+    inverse = cv2.invertAffineTransform(matrix)
+    corners = np.array([[x, y, 1], [x + w, y, 1], [x, y + h, 1], [x + w, y + h, 1]], dtype=np.float64)
+    source = corners @ inverse.T
+
+    # Footprint in the thermal mosaic, +2 px for the interpolation kernel
+    h_t, w_t = thermal.shape[:2]
+    tx1, ty1 = np.floor(source.min(axis=0)).astype(int) - 2
+    tx2, ty2 = np.ceil(source.max(axis=0)).astype(int) + 2
+    tx1, ty1, tx2, ty2 = max(0, tx1), max(0, ty1), min(w_t, tx2), min(h_t, ty2)
+    if tx2 <= tx1 or ty2 <= ty1:
+        return np.zeros((h, w), dtype=np.uint8)
+
+    # Same transform, expressed from the window's origin to the tile's origin
+    tile_matrix = matrix.copy()
+    tile_matrix[:, 2] = matrix @ np.array([tx1, ty1, 1.0]) - np.array([x, y])
+    window = thermal.read_gray(tx1, ty1, tx2 - tx1, ty2 - ty1)
+    return cv2.warpAffine(window, tile_matrix, (w, h))
+
+# ================= CONTRAST =================
+class MosaicCLAHE:
+    """
+    OverlayEngine's CLAHE evaluated on the whole aligned canvas, one window at a time.
+    accumulate() adds each window to the cell histograms (including the pixels
+    cv2.CLAHE mirrors into its bottom / right padding), finish() turns them into
+    the clipped per-cell LUTs, and apply() interpolates those LUTs at canvas
+    coordinates. The result matches cv2.CLAHE on the full canvas, so tile
+    borders are not visible.
+    """
+
+    def __init__(self, width: int, height: int,
+                 clip_limit: float = OverlayEngine.CLAHE_CLIP, grid: Tuple[int, int] = OverlayEngine.CLAHE_GRID):
+        grid_x, grid_y = grid
+        self.size = (width, height)
+        self.grid = grid
+        # cv2.CLAHE pads both axes by (grid - size % grid) unless both divide evenly
+        if width % grid_x or height % grid_y:
+            self.padded = (width + grid_x - width % grid_x, height + grid_y - height % grid_y)
+        else:
+            self.padded = (width, height)
+        self.cell = (self.padded[0] // grid_x, self.padded[1] // grid_y)
+        self.clip_limit = clip_limit
+        self.luts: Optional[np.ndarray] = None
+        self._hist = np.zeros((grid_y, grid_x, 256), dtype=np.int64)
+
+    def _segments(self, start: int, length: int, axis: int) -> list:
+        """
+        (first, last, cell) ranges of a window along one axis, window-relative.
+        """
+        size, padded, cell, count = self.size[axis], self.padded[axis], self.cell[axis], self.grid[axis]
+        end = start + length
+        segments = []
+        for index in range(start // cell, min(count, -(-end // cell))):
+            first, last = max(start, index * cell), min(end, (index + 1) * cell, size)
+            if first < last:
+                segments.append((first - start, last - start, index))
+        # Reflect-101 padding repeats size-2, size-3, ... in the last cell
+        first, last = max(start, 2 * size - 1 - padded), min(end, size - 1)
+        if first < last:
+            segments.append((first - start, last - start, count - 1))
+        return segments
+
+    def accumulate(self, x: int, y: int, aligned: np.ndarray) -> None:
+        h, w = aligned.shape
+        for y1, y2, cell_y in self._segments(y, h, 1):
+            for x1, x2, cell_x in self._segments(x, w, 0):
+                self._hist[cell_y, cell_x] += np.bincount(aligned[y1:y2, x1:x2].ravel(), minlength=256)
+
+    def finish(self) -> None:
+        """
+        Clip, redistribute and integrate the histograms exactly as cv2.CLAHE does.
+        """
+        area = self.cell[0] * self.cell[1]
+        limit = max(int(self.clip_limit * area / 256), 1)
+        hist = self._hist.reshape(-1, 256)
+        excess = np.maximum(hist - limit, 0).sum(axis=1)
+        hist = np.minimum(hist, limit) + (excess // 256)[:, None]
+        for row, residual in zip(hist, excess % 256):
+            if residual:
+                row[::max(256 // residual, 1)][:residual] += 1
+
+        scale = np.float32(255) / np.float32(area)
+        luts = np.rint(np.cumsum(hist, axis=1).astype(np.float32) * scale)
+        self.luts = np.clip(luts, 0, 255).astype(np.uint8).reshape(self._hist.shape)
+
+    def _weights(self, start: int, length: int, axis: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Neighbouring cell indices and the weight of the second one, per canvas coordinate.
+        """
+        position = np.arange(start, start + length, dtype=np.float32) * np.float32(1.0 / self.cell[axis]) - np.float32(0.5)
+        first = np.floor(position)
+        weight = position - first
+        first = first.astype(np.intp)
+        return np.maximum(first, 0), np.minimum(first + 1, self.grid[axis] - 1), weight
+
+    def apply(self, x: int, y: int, aligned: np.ndarray) -> np.ndarray:
+        h, w = aligned.shape
+        left, right, wx = self._weights(x, w, 0)
+        top, bottom, wy = self._weights(y, h, 1)
+        luts = self.luts.astype(np.float32)
+        # float32 throughout, like cv2.CLAHE, so the rounding agrees
+        one = np.float32(1)
+        upper = luts[top[:, None], left, aligned] * (one - wx) + luts[top[:, None], right, aligned] * wx
+        lower = luts[bottom[:, None], left, aligned] * (one - wx) + luts[bottom[:, None], right, aligned] * wx
+        enhanced = upper * (one - wy)[:, None] + lower * wy[:, None]
+        return np.clip(np.rint(enhanced), 0, 255).astype(np.uint8)
+
+# ================= TILED RENDER =================
+def render_tiled(rgb_path: Path, thermal_path: Path, out_path: Path, config: Config,
+                 best_result: Optional[dict] = None) -> dict:
+    """
+    Aligns (unless best_result is given) and renders the overlay tile by tile.
+    The aligned thermal is warped twice per tile: once for the mosaic-wide CLAHE
+    histograms, once for the render, so memory stays bounded by TILE_SIZE.
+    """
+    rgb = open_raster(rgb_path)
+    thermal = open_raster(thermal_path)
+    try:
+        if len(rgb.shape) != 3:
+            raise ValueError(f"{rgb_path.name}: RGB mosaic must have 3 channels")
+        h_rgb, w_rgb = rgb.shape[:2]
+
+        start = time.perf_counter()
+        if best_result is None:
+            best_result = overview_alignment(rgb, thermal, config)
+        matrix = AlignmentEngine.alignment_matrix(best_result, thermal.shape, rgb.shape)
+        logger.info(f"Alignment: scale={best_result['scale']:.3f} score={best_result['score']:.2f} "
+                    f"({time.perf_counter() - start:.1f}s)")
+
+        tile = config.TILE_SIZE
+        windows = [(x, y, min(tile, w_rgb - x), min(tile, h_rgb - y))
+                   for y in range(0, h_rgb, tile) for x in range(0, w_rgb, tile)]
+
+        contrast = MosaicCLAHE(w_rgb, h_rgb)
+        for x, y, w, h in tqdm(windows, unit="tile", desc="Contrast"):
+            contrast.accumulate(x, y, warp_tile(thermal, matrix, x, y, w, h))
+        contrast.finish()
+
+        engine = OverlayEngine(config)
+        sink = open_sink(out_path, (h_rgb, w_rgb, 3), like=rgb)
+        try:
+            for x, y, w, h in tqdm(windows, unit="tile", desc="Render"):
+                aligned = warp_tile(thermal, matrix, x, y, w, h)
+                overlay = engine.render(rgb.read(x, y, w, h), aligned, enhanced=contrast.apply(x, y, aligned))
+                sink.write(x, y, overlay)
+        finally:
+            sink.close()
+
+        return {"tiles": len(windows), "seconds": time.perf_counter() - start,
+                "peak_rss_mb": peak_rss_mb(), **best_result}
+    finally:
+        rgb.close()
+        thermal.close()
+
+# ================= MAIN ENTRY POINT =================
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Tiled RGB / Thermal overlay for large orthomosaics")
+    parser.add_argument("rgb", type=Path, help="RGB mosaic (.npy, or any rasterio format)")
+    parser.add_argument("thermal", type=Path, help="Thermal mosaic (.npy, or any rasterio format)")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Overlay (.npy, or .tif with rasterio)")
+    parser.add_argument("--tile", type=int, help="Override Config.TILE_SIZE")
+    parser.add_argument("--overview", type=int, help="Override Config.OVERVIEW_SIZE")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cfg = Config()
+    if args.tile:
+        cfg = replace(cfg, TILE_SIZE=args.tile)
+    if args.overview:
+        cfg = replace(cfg, OVERVIEW_SIZE=args.overview)
+
+    stats = render_tiled(args.rgb, args.thermal, args.output, cfg)
+    logger.info(f"{stats['tiles']} tile(s) in {stats['seconds']:.1f}s, peak RSS {stats['peak_rss_mb']} MB. "
+                f"Output saved to: {args.output}")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+RGB / Thermal overlay for synchronised video streams.
+
+The first frame gets the full alignment search. Later frames only refine
+the previous transform: the previous scale and its two grid neighbours are
+matched in a small window around the previous position, which costs three
+windowed matchTemplate calls instead of a full sweep. The full search only
+runs again when the refined score drops below VIDEO_RESEARCH_SCORE, or
+below VIDEO_RESEARCH_DROP x the score of the last full search (camera switch,
+zoom, lost lock). Encoding runs on a background thread.
+
+    python video_overlay.py DJI_0001_Z.MP4 DJI_0001_T.MP4 -o DJI_0001_AT.mp4
+"""
+import argparse
+import queue
+import sys
+import threading
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from task_1_code import AlignmentEngine, Config, logger, overlay_engine
+
+
+# ================= TRACKING =================
+class AlignmentTracker:
+    """
+    Carries the rig transform from frame to frame (in track-resolution pixels).
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.best_result: Optional[dict] = None
+        self.reference_score = 0.0   # Score of the last full search
+        self.searches = 0
+
+    def update(self, rgb_img: np.ndarray, thermal_raw: np.ndarray) -> dict:
+        """
+        Refines the previous fit, falls back to the full search when it is lost.
+        """
+        if self.best_result is not None:
+            refined = self.refine(rgb_img, thermal_raw)
+            threshold = max(self.config.VIDEO_RESEARCH_SCORE,
+                            self.config.VIDEO_RESEARCH_DROP * self.reference_score)
+            if refined is not None and refined["score"] >= threshold:
+                self.best_result = refined
+                return refined
+
+        self.best_result = AlignmentEngine.estimate_alignment(rgb_img, thermal_raw, self.config)
+        self.reference_score = self.best_result["score"]
+        self.searches += 1
+        return self.best_result
+
+    def refine(self, rgb_img: np.ndarray, thermal_raw: np.ndarray) -> Optional[dict]:
+        """
+        Previous scale +/- one SCALE_STEP, each within +/- VIDEO_REFINE_RADIUS
+        of the previous position. Rotation is kept from the last full search.
+        """
+        config, previous = self.config, self.best_result
+        h, w = rgb_img.shape[:2]
+        skel_rgb = AlignmentEngine.extract_skeleton(rgb_img)
+
+        # Thermal centre on the canvas does not move with the scale
+        center_x = previous["loc"][0] - previous["offset"][0] + int(w * previous["scale"]) / 2
+        center_y = previous["loc"][1] - previous["offset"][1] + int(h * previous["scale"]) / 2
+
+        scales = [scale for scale in (previous["scale"] - config.SCALE_STEP, previous["scale"],
+                                      previous["scale"] + config.SCALE_STEP)
+                  if config.SCALE_RANGE[0] <= scale <= config.SCALE_RANGE[1]]
+
+        def evaluate(scale: float) -> Optional[dict]:
+            start_hint = (int(round(center_x - int(w * scale) / 2)), int(round(center_y - int(h * scale) / 2)))
+            return AlignmentEngine.match_scale(skel_rgb, thermal_raw, scale, start_hint=start_hint,
+                                               radius=config.VIDEO_REFINE_RADIUS)
+
+        best_result = None
+        for result in AlignmentEngine._map_scales(evaluate, scales, config):
+            if result is not None and (best_result is None or result["score"] > best_result["score"]):
+                best_result = result
+        if best_result is not None:
+            best_result["rotation"] = previous.get("rotation", 0.0)
+        return best_result
+
+# ================= OUTPUT =================
+class VideoFrameWriter:
+    """
+    Background VideoWriter: a bounded queue drained by one thread
+    (frame order matters), so encoding overlaps with the next frame.
+    """
+
+    def __init__(self, path: Path, fourcc: str, fps: float, size, queue_size: int = 4):
+        self.writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if not self.writer.isOpened():
+            raise ValueError(f"Cannot open {path} for writing (fourcc {fourcc})")
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="video-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame: np.ndarray) -> None:
+        self._queue.put(frame)
+
+    def _run(self) -> None:
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                return
+            self.writer.write(frame)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        self.writer.release()
+
+# ================= VIDEO PIPELINE =================
+def run_video(rgb_path: Path, thermal_path: Path, out_path: Path, config: Config) -> dict:
+    """
+    Aligns and overlays two synchronised streams frame by frame.
+    Stops at the end of the shorter stream.
+    """
+    rgb_cap = cv2.VideoCapture(str(rgb_path))
+    thermal_cap = cv2.VideoCapture(str(thermal_path))
+    if not rgb_cap.isOpened() or not thermal_cap.isOpened():
+        raise ValueError(f"Cannot open {rgb_path if not rgb_cap.isOpened() else thermal_path}")
+
+    fps = rgb_cap.get(cv2.CAP_PROP_FPS) or 30.0
+    total = int(min(rgb_cap.get(cv2.CAP_PROP_FRAME_COUNT), thermal_cap.get(cv2.CAP_PROP_FRAME_COUNT))) or None
+
+    tracker = AlignmentTracker(config)
+    engine = overlay_engine(config)
+    writer: Optional[VideoFrameWriter] = None
+    scores = []
+    start = time.perf_counter()
+    try:
+        with tqdm(total=total, unit="frame") as progress:
+            while True:
+                ok_rgb, rgb = rgb_cap.read()
+                ok_thermal, thermal = thermal_cap.read()
+                if not ok_rgb or not ok_thermal:
+                    break
+                if thermal.ndim == 3:
+                    thermal = cv2.cvtColor(thermal, cv2.COLOR_BGR2GRAY)
+
+                h, w = rgb.shape[:2]
+                if writer is None:
+                    writer = VideoFrameWriter(out_path, config.VIDEO_FOURCC, fps, (w, h), config.WRITER_QUEUE)
+
+                # Search / track on a reduced frame, reconstruct at full resolution
+                if w > config.VIDEO_TRACK_WIDTH:
+                    size = (config.VIDEO_TRACK_WIDTH, max(1, round(h * config.VIDEO_TRACK_WIDTH / w)))
+                    rgb_track = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+                else:
+                    rgb_track = rgb
+                best_result = tracker.update(rgb_track, thermal)
+                if rgb_track is not rgb:
+                    best_result = AlignmentEngine.scale_result(best_result, w / rgb_track.shape[1])
+
+                aligned = AlignmentEngine.apply_alignment(thermal, best_result, rgb.shape)
+                writer.submit(engine.render(rgb, aligned, out=rgb))
+                scores.append(best_result["score"])
+                progress.update()
+    finally:
+        if writer is not None:
+            writer.close()
+        rgb_cap.release()
+        thermal_cap.release()
+
+    seconds = time.perf_counter() - start
+    return {"frames": len(scores), "searches": tracker.searches, "seconds": seconds,
+            "fps": len(scores) / seconds if seconds else 0.0,
+            "mean_score": float(np.mean(scores)) if scores else None}
+
+# ================= MAIN ENTRY POINT =================
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="RGB / Thermal overlay for video streams")
+    parser.add_argument("rgb", type=Path, help="RGB video")
+    parser.add_argument("thermal", type=Path, help="Thermal video (same frame timing)")
+    parser.add_argument("-o", "--output", type=Path, required=True, help="Overlay video")
+    parser.add_argument("--track-width", type=int, help="Override Config.VIDEO_TRACK_WIDTH")
+    parser.add_argument("--research-score", type=float, help="Override Config.VIDEO_RESEARCH_SCORE")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cfg = Config()
+    if args.track_width:
+        cfg = replace(cfg, VIDEO_TRACK_WIDTH=args.track_width)
+    if args.research_score is not None:
+        cfg = replace(cfg, VIDEO_RESEARCH_SCORE=args.research_score)
+
+    stats = run_video(args.rgb, args.thermal, args.output, cfg)
+    logger.info(f"{stats['frames']} frame(s) at {stats['fps']:.1f} fps, {stats['searches']} full search(es), "
+                f"mean score {stats['mean_score'] or 0:.2f}. Output saved to: {args.output}")
@@ -1,242 +1,960 @@
 import cv2
 import numpy as np
+import io
 import os
+import json
+import time
+import queue
+import tarfile
+import threading
+import hashlib
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
 
-# ----------------- PATHS -----------------
-input_dir = r"C:\Users\vipin\Downloads\ProductizeTech - AI Fulltime Assignment-20251122T062524Z-1-001\ProductizeTech - AI Fulltime Assignment\Task 2 - Change Detection Algorithm\input-images"
-output_dir = r"C:\Users\vipin\Downloads\ProductizeTech - AI Fulltime Assignment-20251122T062524Z-1-001\ProductizeTech - AI Fulltime Assignment\Task 2 - Change Detection Algorithm\task_2_output"
+try:  # Optional: Parquet detection records
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
-# Create main output folder
-os.makedirs(output_dir, exist_ok=True)
+# ----------------- CONFIGURATION -----------------
+@dataclass
+class Config:
+    """Central configuration for the change detection pipeline."""
+    INPUT_DIR: Path = Path(r"C:\Users\vipin\Downloads\ProductizeTech - AI Fulltime Assignment-20251122T062524Z-1-001\ProductizeTech - AI Fulltime Assignment\Task 2 - Change Detection Algorithm\input-images")
+    OUTPUT_DIR: Path = Path(r"C:\Users\vipin\Downloads\ProductizeTech - AI Fulltime Assignment-20251122T062524Z-1-001\ProductizeTech - AI Fulltime Assignment\Task 2 - Change Detection Algorithm\task_2_output")
 
-# Create sub-folder for cropped changes (Dataset Creation)
-crops_dir = os.path.join(output_dir, "crops")
-os.makedirs(crops_dir, exist_ok=True)
+    # Alignment (ORB + RANSAC homography)
+    ORB_FEATURES: int = 5000
+    MATCH_KEEP: float = 0.15     # Best fraction of matches used for the homography ("bruteforce")
+    ALIGN_MODE: str = "full"     # "full" (features at full size) | "pyramid" (estimate small, warp once at full size)
+    ALIGN_MAX_SIDE: int = 1024   # Longest side of the "pyramid" estimation level
+    ALIGN_REFINE_WINDOW: int = 0 # "pyramid": ECC refine on a centred full-res window of this size (0 = off)
+    MATCHER: str = "bruteforce"  # "bruteforce" (cross-image best match) | "ratio" (KNN + ratio test) | "flann" (LSH + ratio test)
+    RATIO_TEST: float = 0.75     # Lowe's ratio for "ratio" / "flann"
+    FEATURE_CACHE: bool = True   # Reuse reference (before) keypoints/descriptors across pairs and runs
+    FEATURE_CACHE_DIR: Optional[Path] = None  # None = OUTPUT_DIR/feature_cache
+    FEATURE_CACHE_SIZE: int = 32 # In-memory LRU entries per process
+
+    # Difference & Thresholding
+    BLUR_KSIZE: int = 5
+    DIFF_THRESHOLD: int = 25
+    ADAPTIVE_BLOCK: int = 11
+    ADAPTIVE_C: int = 2
+
+    # Regions (adjust MIN_AREA based on drone height)
+    REGION_METHOD: str = "contours"  # "contours" (polygon area) | "components" (connectedComponentsWithStats, pixel area)
+    MIN_AREA: float = 200
+    MIN_BOX_SIDE: int = 0        # Drop regions whose bbox is thinner than this (0 = off)
+    BORDER_MARGIN: int = 0       # Drop regions centred within this many px of the edge, e.g. warp borders (0 = off)
+    MEDIUM_AREA: float = 800
+    LARGE_AREA: float = 2000
+    CROP_MARGIN: int = 10
+    CROP_FORMAT: str = "files"   # "files" (one JPEG per change) | "tar" (size-bounded shards + index.jsonl)
+    CROP_SHARD_MB: int = 256     # "tar": max shard size
+
+    # Visual Parameters
+    FILL_ALPHA: float = 0.3      # 30% transparency
+    BOX_COLOR: Tuple[int, int, int] = (0, 255, 0)  # Neon Green for visibility
+
+    # Detection records (one batched file per run)
+    HEADLESS: bool = False       # Detect only: no composites or crops, records only
+    RECORDS: bool = False        # Also write records when rendering
+    RECORDS_PATH: Optional[Path] = None  # None = OUTPUT_DIR/detections.<format>
+    RECORDS_FORMAT: str = "jsonl"        # "jsonl" | "parquet" (needs pyarrow)
+
+    # System (0 = auto from os.cpu_count())
+    MAX_WORKERS: int = 0
+    CV_THREADS: int = 0
+    CHUNKSIZE: int = 0
+
+
+@dataclass
+class PairResult:
+    """Outcome of one before/after pair, returned by the worker."""
+    status: str        # "SAVED" | "DETECTED" (headless) | "WARNING" | "ERROR"
+    base: str
+    message: str
+    changes: int = 0
+    record: Optional[dict] = None   # Detection record, when records are written
+    crops: Optional[list] = None    # (index entry, JPEG bytes) per change, CROP_FORMAT "tar"
+
+    def __str__(self) -> str:
+        return f"[{self.status}] {self.message}"
+
+# One row per detected change; "size" indexes SIZE_LABELS / SIZE_THICKNESS
+REGION_DTYPE = np.dtype([("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32),
+                         ("area", np.float64), ("cx", np.float32), ("cy", np.float32), ("size", np.uint8)])
+SIZE_LABELS = ("Small", "Medium", "Large")
+SIZE_THICKNESS = (2, 3, 4)
+
+# ----------------- FEATURE CACHE -----------------
+class FeatureCache:
+    """
+    ORB keypoints/descriptors keyed by image content hash + ORB parameters.
+    Two tiers: an in-memory LRU per process and one .npz file per entry on
+    disk (shared by all workers and later runs).
+    """
+
+    def __init__(self, directory: Optional[Path], max_entries: int = 32):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(gray: np.ndarray, orb) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(gray), digest_size=16)
+        params = (gray.shape, orb.getMaxFeatures(), orb.getScaleFactor(), orb.getNLevels(),
+                  orb.getEdgeThreshold(), orb.getFirstLevel(), orb.getWTA_K(),
+                  orb.getScoreType(), orb.getPatchSize(), orb.getFastThreshold())
+        digest.update(repr(params).encode())
+        return digest.hexdigest()
+
+    def detect_and_compute(self, orb, gray: np.ndarray):
+        """
+        Same result as orb.detectAndCompute(gray, None), from cache when possible.
+        """
+        key = self.key(gray, orb)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        features = self._load(key)
+        if features is None:
+            features = orb.detectAndCompute(gray, None)
+            self._save(key, *features)
+
+        self._memory[key] = features
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        return features
+
+    def _load(self, key: str):
+        if self.directory is None:
+            return None
+        path = self.directory / f"{key}.npz"
+        try:
+            with np.load(path) as data:
+                rows, descriptors = data["keypoints"], data["descriptors"]
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            return None
+        keypoints = tuple(cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response),
+                                       int(octave), int(class_id))
+                          for x, y, size, angle, response, octave, class_id in rows)
+        return keypoints, (descriptors if len(descriptors) else None)
+
+    def _save(self, key: str, keypoints, descriptors) -> None:
+        if self.directory is None:
+            return
+        rows = np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+                         for kp in keypoints], dtype=np.float32).reshape(-1, 7)
+        if descriptors is None:
+            descriptors = np.empty((0, 32), dtype=np.uint8)
+        # Write-then-rename: workers may race on the same reference image
+        partial_path = self.directory / f".{key}.{os.getpid()}.npz"
+        np.savez(partial_path, keypoints=rows, descriptors=descriptors)
+        os.replace(partial_path, self.directory / f"{key}.npz")
+
+
+_feature_cache: Optional[FeatureCache] = None
+
+
+def feature_cache(config: Config) -> Optional[FeatureCache]:
+    """
+    This process's FeatureCache (None when FEATURE_CACHE is off).
+    """
+    global _feature_cache
+    if not config.FEATURE_CACHE:
+        return None
+    directory = config.FEATURE_CACHE_DIR or config.OUTPUT_DIR / "feature_cache"
+    if _feature_cache is None or _feature_cache.directory != directory:
+        _feature_cache = FeatureCache(directory, config.FEATURE_CACHE_SIZE)
+    return _feature_cache
+
+# ----------------- HELPER: FEATURE MATCHING -----------------
+# FLANN index for binary descriptors (multi-probe LSH)
+FLANN_LSH_PARAMS = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1)
+
+
+def best_indices(distances: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k smallest distances, in the same order as a stable sort
+    (ties keep match order), via argpartition instead of a full sort.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= len(distances):
+        return np.argsort(distances, kind="stable")
+    cutoff = distances[np.argpartition(distances, k - 1)[k - 1]]
+    below = np.flatnonzero(distances < cutoff)
+    ties = np.flatnonzero(distances == cutoff)[:k - len(below)]
+    selected = np.concatenate([below, ties])
+    return selected[np.lexsort((selected, distances[selected]))]
+
+
+def match_features(des1, des2, method="bruteforce", keep=0.15, ratio=0.75):
+    """
+    Matches reference descriptors des1 against target descriptors des2.
+    Returns (query_idx, train_idx) arrays of the matches to fit on.
+    """
+    if method == "bruteforce":
+        # Best match per reference feature, then the best `keep` fraction
+        matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
+        matches = matcher.match(des1, des2, None)
+        distances = np.fromiter((m.distance for m in matches), np.float32, len(matches))
+        chosen = [matches[i] for i in best_indices(distances, int(len(matches) * keep))]
+    elif method in ("ratio", "flann"):
+        # Two nearest neighbours, keep the unambiguous ones
+        if method == "flann":
+            matcher = cv2.FlannBasedMatcher(FLANN_LSH_PARAMS, dict(checks=50))
+        else:
+            matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
+        chosen = [pair[0] for pair in matcher.knnMatch(des1, des2, k=2)
+                  if len(pair) == 2 and pair[0].distance < ratio * pair[1].distance]
+    else:
+        raise ValueError(f"Unknown MATCHER: {method!r}")
+
+    query_idx = np.fromiter((m.queryIdx for m in chosen), np.intp, len(chosen))
+    train_idx = np.fromiter((m.trainIdx for m in chosen), np.intp, len(chosen))
+    return query_idx, train_idx
 
 # ----------------- HELPER: IMAGE ALIGNMENT -----------------
-def align_images(img_ref, img_target):
+def estimate_homography(img_ref, img_target, n_features=5000, keep=0.15, cache=None,
+                        matcher="bruteforce", ratio=0.75):
     """
-    Aligns img_target to match img_ref using ORB features.
-    Fixes small camera shakes.
+    Homography mapping img_target onto img_ref (ORB + RANSAC), or None,
+    plus its stats (keypoints per image, matches, RANSAC inliers).
+    With a FeatureCache, the reference features are computed once per image.
     """
     # Convert to grayscale
     gray_ref = cv2.cvtColor(img_ref, cv2.COLOR_BGR2GRAY)
     gray_target = cv2.cvtColor(img_target, cv2.COLOR_BGR2GRAY)
-    
+
     # Detect ORB features
-    orb = cv2.ORB_create(5000)
-    kp1, des1 = orb.detectAndCompute(gray_ref, None)
+    orb = cv2.ORB_create(n_features)
+    if cache is not None:
+        kp1, des1 = cache.detect_and_compute(orb, gray_ref)
+    else:
+        kp1, des1 = orb.detectAndCompute(gray_ref, None)
     kp2, des2 = orb.detectAndCompute(gray_target, None)
-    
+    stats = {"keypoints": [len(kp1), len(kp2)], "matches": 0, "inliers": 0}
+
     if des1 is None or des2 is None:
-        return img_target # Cannot align
-
-    # Match features
-    matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
-    matches = matcher.match(des1, des2, None)
-    
-    # Sort and keep top 15% matches
-    matches = sorted(matches, key=lambda x: x.distance)
-    good_matches = matches[:int(len(matches) * 0.15)]
-    
-    if len(good_matches) < 4:
-        return img_target # Not enough matches to align
+        return None, stats # Cannot align
 
-    # Extract location of good matches
-    points1 = np.zeros((len(good_matches), 2), dtype=np.float32)
-    points2 = np.zeros((len(good_matches), 2), dtype=np.float32)
+    # Match features (bruteforce: sorted, top 15% kept)
+    query_idx, train_idx = match_features(des1, des2, matcher, keep, ratio)
+    stats["matches"] = len(query_idx)
 
-    for i, match in enumerate(good_matches):
-        points1[i, :] = kp1[match.queryIdx].pt
-        points2[i, :] = kp2[match.trainIdx].pt
+    if len(query_idx) < 4:
+        return None, stats # Not enough matches to align
+
+    # Extract location of good matches
+    points1 = cv2.KeyPoint_convert(kp1)[query_idx]
+    points2 = cv2.KeyPoint_convert(kp2)[train_idx]
 
     # Find Homography
-    h_matrix, _ = cv2.findHomography(points2, points1, cv2.RANSAC)
-    
+    h_matrix, mask = cv2.findHomography(points2, points1, cv2.RANSAC)
+    stats["inliers"] = int(mask.sum()) if h_matrix is not None else 0
+    return h_matrix, stats
+
+
+def align_images(img_ref, img_target, n_features=5000, keep=0.15, cache=None,
+                 matcher="bruteforce", ratio=0.75):
+    """
+    Aligns img_target to match img_ref using ORB features.
+    Fixes small camera shakes.
+    """
+    h_matrix, _ = estimate_homography(img_ref, img_target, n_features, keep, cache, matcher, ratio)
+
     if h_matrix is None:
         return img_target
 
     # Warp image
     height, width = img_ref.shape[:2]
     aligned_img = cv2.warpPerspective(img_target, h_matrix, (width, height))
-    
+
     return aligned_img
 
-# ----------------- MAIN PROCESSING -----------------
-for file in os.listdir(input_dir):
-    if file.endswith(".jpg") and "~2" not in file:
-        base = file.replace(".jpg", "")
-        before_path = os.path.join(input_dir, file)
-        after_path = os.path.join(input_dir, base + "~2.jpg")
 
-        if not os.path.exists(after_path):
-            print(f"[WARNING] Missing after image for {base}")
-            continue
+def scale_matrix(sx: float, sy: float) -> np.ndarray:
+    """
+    Pixel mapping of cv2.resize by (sx, sy) as a 3x3 matrix (pixel centres aligned).
+    """
+    return np.array([[sx, 0, 0.5 * (sx - 1)],
+                     [0, sy, 0.5 * (sy - 1)],
+                     [0, 0, 1]], dtype=np.float64)
 
-        print(f"[PROCESSING] {base}")
 
-        before = cv2.imread(before_path)
-        after = cv2.imread(after_path)
+def refine_homography(gray_ref, gray_target, h_matrix, window):
+    """
+    ECC refinement of h_matrix (target -> ref) on a centred window x window
+    patch of the reference. Returns h_matrix unchanged if ECC does not converge.
+    """
+    height, width = gray_ref.shape[:2]
+    win_w, win_h = min(window, width), min(window, height)
+    x0, y0 = (width - win_w) // 2, (height - win_h) // 2
+    template = gray_ref[y0:y0 + win_h, x0:x0 + win_w]
+    offset = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=np.float64)
 
-        if before is None or after is None:
-            print(f"[ERROR] Failed to read images for {base}")
-            continue
+    # ECC warps map template (window) coordinates into the target image
+    warp = (np.linalg.inv(h_matrix) @ offset).astype(np.float32)
+    warp /= warp[2, 2]
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 50, 1e-4)
+    try:
+        _, warp = cv2.findTransformECC(template, gray_target, warp, cv2.MOTION_HOMOGRAPHY, criteria, None, 5)
+    except cv2.error:
+        return h_matrix
+    return offset @ np.linalg.inv(warp.astype(np.float64))
 
-        # Resize after image to match before image dimensions
-        after = cv2.resize(after, (before.shape[1], before.shape[0]))
+# ----------------- CHANGE DETECTOR -----------------
+class ChangeDetector:
+    """
+    Before/after change detection, one method per stage:
+    align -> diff -> threshold -> regions -> render.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config or Config()
+        self.kernel = np.ones((3, 3), np.uint8)
+        self.alignment: dict = {}   # Stats of the last align() (mode, homography, matches, inliers)
+        self.timings: dict = {}     # Seconds per stage of the last detect()
 
-        # --- STEP 1: AUTO-ALIGNMENT (Fix Camera Shake) ---
-        # This reduces false positives significantly
+    def align(self, before: np.ndarray, after: np.ndarray) -> np.ndarray:
+        """
+        STEP 1: AUTO-ALIGNMENT (Fix Camera Shake).
+        This reduces false positives significantly.
+        """
+        mode = self.config.ALIGN_MODE
         try:
-            after_aligned = align_images(before, after)
+            if mode == "pyramid":
+                h_matrix, stats = self.estimate_pyramid(before, after)
+            else:
+                # Resize after image to match before image dimensions
+                after_resized = cv2.resize(after, (before.shape[1], before.shape[0]))
+                h_matrix, stats = estimate_homography(before, after_resized, self.config.ORB_FEATURES,
+                                                      self.config.MATCH_KEEP, feature_cache(self.config),
+                                                      self.config.MATCHER, self.config.RATIO_TEST)
         except Exception as e:
             print(f"  [Log] Alignment skipped due to error: {e}")
-            after_aligned = after
+            h_matrix, stats = None, {"keypoints": [0, 0], "matches": 0, "inliers": 0}
+
+        self.alignment = {"mode": mode, "homography": h_matrix.tolist() if h_matrix is not None else None,
+                          **stats}
+        return self.warp(before, after, h_matrix, mode)
+
+    @staticmethod
+    def warp(before: np.ndarray, after: np.ndarray, h_matrix: Optional[np.ndarray], mode: str = "full") -> np.ndarray:
+        """
+        Applies an align() homography to the original after image. "full"
+        matrices act on the after image resized to the before size,
+        "pyramid" matrices on the original after image. None = resize only.
+        """
+        size = (before.shape[1], before.shape[0])
+        if mode != "pyramid" or h_matrix is None:
+            after = cv2.resize(after, size)
+            if h_matrix is None:
+                return after
+        return cv2.warpPerspective(after, np.asarray(h_matrix, dtype=np.float64), size)
 
-        # --- STEP 2: PRE-PROCESSING ---
+    def estimate_pyramid(self, before: np.ndarray, after: np.ndarray) -> Tuple[Optional[np.ndarray], dict]:
+        """
+        STEP 1 ("pyramid"): homography from a level with ALIGN_MAX_SIDE as
+        longest side, mapped back to full resolution. The resize to the before
+        size is folded into the same matrix, so the after image is resampled
+        by a single warpPerspective.
+        """
+        height, width = before.shape[:2]
+        after_h, after_w = after.shape[:2]
+        factor = min(1.0, self.config.ALIGN_MAX_SIDE / max(height, width))
+        small_size = (max(1, round(width * factor)), max(1, round(height * factor)))
+
+        before_small = cv2.resize(before, small_size, interpolation=cv2.INTER_AREA)
+        after_small = cv2.resize(after, small_size, interpolation=cv2.INTER_AREA)
+        h_small, stats = estimate_homography(before_small, after_small, self.config.ORB_FEATURES,
+                                             self.config.MATCH_KEEP, feature_cache(self.config),
+                                             self.config.MATCHER, self.config.RATIO_TEST)
+        if h_small is None:
+            return None, stats
+
+        # after (full) -> after_small -> before_small -> before (full)
+        to_small = scale_matrix(small_size[0] / after_w, small_size[1] / after_h)
+        from_small = np.linalg.inv(scale_matrix(small_size[0] / width, small_size[1] / height))
+        h_full = from_small @ h_small @ to_small
+
+        if self.config.ALIGN_REFINE_WINDOW:
+            h_full = refine_homography(cv2.cvtColor(before, cv2.COLOR_BGR2GRAY),
+                                       cv2.cvtColor(after, cv2.COLOR_BGR2GRAY),
+                                       h_full, self.config.ALIGN_REFINE_WINDOW)
+        return h_full, stats
+
+    def diff(self, before: np.ndarray, after_aligned: np.ndarray) -> np.ndarray:
+        """
+        STEP 2-3: Pre-processing and combined difference map.
+        """
         # Apply Gaussian blur to reduce noise
-        before_blur = cv2.GaussianBlur(before, (5, 5), 0)
-        after_blur = cv2.GaussianBlur(after_aligned, (5, 5), 0)
-        
+        ksize = (self.config.BLUR_KSIZE, self.config.BLUR_KSIZE)
+        before_blur = cv2.GaussianBlur(before, ksize, 0)
+        after_blur = cv2.GaussianBlur(after_aligned, ksize, 0)
+
         gray_before = cv2.cvtColor(before_blur, cv2.COLOR_BGR2GRAY)
         gray_after = cv2.cvtColor(after_blur, cv2.COLOR_BGR2GRAY)
 
-        # --- STEP 3: DIFFERENCE CALCULATION ---
         # Method 1: Absolute difference
         diff = cv2.absdiff(gray_before, gray_after)
-        
+
         # Method 2: Color difference (catches changes even if brightness is same)
         diff_color = cv2.absdiff(before_blur, after_blur)
         diff_gray_from_color = cv2.cvtColor(diff_color, cv2.COLOR_BGR2GRAY)
-        
+
         # Combine methods for robustness
-        combined_diff = cv2.addWeighted(diff, 0.6, diff_gray_from_color, 0.4, 0)
-        
-        # --- STEP 4: THRESHOLDING ---
-        _, thresh = cv2.threshold(combined_diff, 25, 255, cv2.THRESH_BINARY)
-        
+        return cv2.addWeighted(diff, 0.6, diff_gray_from_color, 0.4, 0)
+
+    def threshold(self, combined_diff: np.ndarray) -> np.ndarray:
+        """
+        STEP 4-5: Binary change mask, cleaned with morphology.
+        """
+        _, thresh = cv2.threshold(combined_diff, self.config.DIFF_THRESHOLD, 255, cv2.THRESH_BINARY)
+
         # Adaptive threshold helps with shadows
         adaptive_thresh = cv2.adaptiveThreshold(
-            combined_diff, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY, 11, 2
+            combined_diff, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, self.config.ADAPTIVE_BLOCK, self.config.ADAPTIVE_C
         )
-        # Combine (OR operation)
+        # Keep pixels both thresholds agree on
         thresh = cv2.bitwise_and(thresh, adaptive_thresh)
 
-        # --- STEP 5: CLEANING (MORPHOLOGY) ---
         # Remove small noise dots
-        kernel = np.ones((3, 3), np.uint8)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=1)
+        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, self.kernel, iterations=1)
         # Fill gaps inside objects
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_DILATE, kernel, iterations=2)
+        return cv2.morphologyEx(thresh, cv2.MORPH_DILATE, self.kernel, iterations=2)
+
+    def regions(self, thresh: np.ndarray) -> np.ndarray:
+        """
+        STEP 6: Changed regions as a REGION_DTYPE array, filtered and size-classed.
+        """
+        if self.config.REGION_METHOD == "components":
+            regions = self.components(thresh)
+        elif self.config.REGION_METHOD == "contours":
+            regions = self.contours(thresh)
+        else:
+            raise ValueError(f"Unknown REGION_METHOD: {self.config.REGION_METHOD!r}")
 
+        # Filter small noise, slivers and warp-border artefacts
+        keep = regions["area"] > self.config.MIN_AREA
+        if self.config.MIN_BOX_SIDE:
+            keep &= np.minimum(regions["w"], regions["h"]) >= self.config.MIN_BOX_SIDE
+        if self.config.BORDER_MARGIN:
+            m = self.config.BORDER_MARGIN
+            height, width = thresh.shape[:2]
+            keep &= ((regions["cx"] >= m) & (regions["cx"] < width - m)
+                     & (regions["cy"] >= m) & (regions["cy"] < height - m))
+        regions = regions[keep]
+
+        # Small / Medium / Large
+        regions["size"] = ((regions["area"] > self.config.MEDIUM_AREA).astype(np.uint8)
+                           + (regions["area"] > self.config.LARGE_AREA))
+        return regions
+
+    def components(self, thresh: np.ndarray) -> np.ndarray:
+        """
+        Unfiltered regions from connectedComponentsWithStats (8-connected, pixel area).
+        """
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        stats, centroids = stats[1:], centroids[1:]   # Label 0 is the background
+
+        regions = np.zeros(len(stats), dtype=REGION_DTYPE)
+        regions["x"], regions["y"] = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+        regions["w"], regions["h"] = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+        regions["area"] = stats[:, cv2.CC_STAT_AREA]
+        regions["cx"], regions["cy"] = centroids[:, 0], centroids[:, 1]
+        return regions
+
+    def contours(self, thresh: np.ndarray) -> np.ndarray:
+        """
+        Unfiltered regions from external contours (polygon area, bbox centre).
+        """
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
+        rects = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=np.int32).reshape(-1, 4)
+
+        regions = np.zeros(len(contours), dtype=REGION_DTYPE)
+        regions["x"], regions["y"], regions["w"], regions["h"] = rects.T
+        regions["area"] = np.fromiter((cv2.contourArea(cnt) for cnt in contours), np.float64, len(contours))
+        regions["cx"] = regions["x"] + regions["w"] / 2
+        regions["cy"] = regions["y"] + regions["h"] / 2
+        return regions
+
+    def crops(self, after_aligned: np.ndarray, changes: np.ndarray) -> List[np.ndarray]:
+        """
+        STEP 6A: Crop of every change with CROP_MARGIN (Dataset Creation).
+        """
+        m = self.config.CROP_MARGIN
+        crops = []
+        for x, y, w, h in zip(changes["x"].tolist(), changes["y"].tolist(),
+                              changes["w"].tolist(), changes["h"].tolist()):
+            crop_y1, crop_y2 = max(0, y-m), min(after_aligned.shape[0], y+h+m)
+            crop_x1, crop_x2 = max(0, x-m), min(after_aligned.shape[1], x+w+m)
+            crops.append(after_aligned[crop_y1:crop_y2, crop_x1:crop_x2])
+        return crops
+
+    def render(self, before: np.ndarray, after_aligned: np.ndarray, changes: np.ndarray) -> np.ndarray:
+        """
+        STEP 7-9: Transparent fills, sharp borders and labels, side-by-side composite.
+        """
+        color = self.config.BOX_COLOR
         output_img = after_aligned.copy()
-        
-        # Create a separate layer for Transparent Fill
+
+        # Draw filled rectangles on a separate layer for the Transparent Fill
         overlay = output_img.copy()
-        
-        change_detected = False
-        change_count = 0
-        changes_list = []
-
-        # --- STEP 6: CONTOUR ANALYSIS & VISUALIZATION ---
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            
-            # Filter small noise (Adjust '200' based on drone height)
-            if area > 200:
-                x, y, w, h = cv2.boundingRect(cnt)
-                change_count += 1
-                
-                # --- A. CROP & SAVE (Dataset Creation) ---
-                # Add margin to crop
-                m = 10
-                crop_y1, crop_y2 = max(0, y-m), min(after_aligned.shape[0], y+h+m)
-                crop_x1, crop_x2 = max(0, x-m), min(after_aligned.shape[1], x+w+m)
-                
-                crop_img = after_aligned[crop_y1:crop_y2, crop_x1:crop_x2]
-                crop_name = f"{base}_change_{change_count}.jpg"
-                cv2.imwrite(os.path.join(crops_dir, crop_name), crop_img)
-                
-                # --- B. SETTINGS ---
-                # Neon Green for visibility
-                box_color = (0, 255, 0) 
-                outline_color = (0, 0, 0)
-
-                if area > 2000:
-                    thickness = 4
-                    label_size = "Large"
-                elif area > 800:
-                    thickness = 3
-                    label_size = "Medium"
-                else:
-                    thickness = 2
-                    label_size = "Small"
-
-                # --- C. DRAW TRANSPARENT FILL ---
-                # Draw filled rectangle on the overlay layer
-                cv2.rectangle(overlay, (x, y), (x + w, y + h), box_color, -1)
-
-                # --- D. DRAW THICK BORDERS ---
-                # Draw Black Outline (Shadow) on original image logic
-                # Note: We draw borders later after merging overlay to keep them sharp
-                
-                change_detected = True
-                
-                # Store visualization data for later loop
-                changes_list.append({
-                    'rect': (x, y, w, h),
-                    'color': box_color,
-                    'thickness': thickness,
-                    'text': f"#{change_count} {label_size}"
-                })
+        boxes = np.stack([changes["x"], changes["y"], changes["w"], changes["h"]], axis=1).tolist()
+        for x, y, w, h in boxes:
+            cv2.rectangle(overlay, (x, y), (x + w, y + h), color, -1)
 
         # --- STEP 7: MERGE TRANSPARENCY ---
-        # Blend the overlay (with filled boxes) and original image
-        alpha = 0.3 # 30% transparency
+        alpha = self.config.FILL_ALPHA
         output_img = cv2.addWeighted(overlay, alpha, output_img, 1 - alpha, 0)
 
         # --- STEP 8: DRAW SHARP BORDERS & LABELS ON TOP ---
-        for item in changes_list:
-            x, y, w, h = item['rect']
-            color = item['color']
-            thick = item['thickness']
-            text = item['text']
-            
+        for number, ((x, y, w, h), size) in enumerate(zip(boxes, changes["size"].tolist()), start=1):
+            thick = SIZE_THICKNESS[size]
+            text = f"#{number} {SIZE_LABELS[size]}"
+
             # 1. Black Outline (Behind)
             cv2.rectangle(output_img, (x, y), (x+w, y+h), (0,0,0), thick+2)
             # 2. Green Border (Front)
             cv2.rectangle(output_img, (x, y), (x+w, y+h), color, thick)
-            
+
             # Label Background
             font = cv2.FONT_HERSHEY_DUPLEX
             font_scale = 0.5
             (text_w, text_h), _ = cv2.getTextSize(text, font, font_scale, 1)
-            
+
             label_y = y - 10 if y > 30 else y + h + 20
-            
+
             # Draw label background (Black border, Green fill)
             cv2.rectangle(output_img, (x, label_y - text_h - 4), (x + text_w + 10, label_y + 6), (0,0,0), -1)
             cv2.rectangle(output_img, (x + 2, label_y - text_h - 2), (x + text_w + 8, label_y + 4), color, -1)
-            
+
             # Draw Text
             cv2.putText(output_img, text, (x + 5, label_y), font, font_scale, (0,0,0), 1)
 
-        # --- STEP 9: SAVE FINAL COMPOSITE ---
+        # --- STEP 9: FINAL COMPOSITE ---
         before_label = cv2.resize(before, (output_img.shape[1], output_img.shape[0]))
-        
+
         # Add titles
         cv2.putText(before_label, "Before", (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 4)
-        cv2.putText(output_img, f"Changes: {change_count}", (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 4)
+        cv2.putText(output_img, f"Changes: {len(changes)}", (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 255, 0), 4)
 
         # Combine side-by-side
-        combined = cv2.hconcat([before_label, output_img])
+        return cv2.hconcat([before_label, output_img])
+
+    def detect(self, before: np.ndarray, after: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Aligned after image and its changes (REGION_DTYPE array) for one pair.
+        """
+        start = time.perf_counter()
+        after_aligned = self.align(before, after)
+        aligned = time.perf_counter()
+        thresh = self.threshold(self.diff(before, after_aligned))
+        diffed = time.perf_counter()
+        changes = self.regions(thresh)
+        self.timings = {"align": aligned - start, "diff": diffed - aligned,
+                        "regions": time.perf_counter() - diffed}
+        return after_aligned, changes
+
+# ----------------- WORKER FUNCTION -----------------
+def init_worker(cv_threads: int) -> None:
+    """
+    Pool initializer: caps OpenCV's own threading inside each process.
+    """
+    cv2.setNumThreads(cv_threads)
+
+
+def save_outputs(detector: ChangeDetector, base: str, before: np.ndarray, after_aligned: np.ndarray,
+                 changes: np.ndarray) -> Tuple[Path, Optional[list]]:
+    """
+    STEP 6A + 9: writes the crops and the final composite. Returns the
+    composite path and, for CROP_FORMAT "tar", the encoded crops for the
+    main process's CropShardWriter.
+    """
+    config = detector.config
+
+    # --- STEP 6A: CROP & SAVE (Dataset Creation) ---
+    crops = detector.crops(after_aligned, changes)
+    encoded = None
+    if config.CROP_FORMAT == "tar":
+        encoded = []
+        for number, (crop_img, region) in enumerate(zip(crops, changes.tolist()), start=1):
+            entry = {"pair": base, "number": number, **dict(zip(REGION_DTYPE.names, region))}
+            entry["size"] = SIZE_LABELS[entry["size"]]
+            encoded.append((entry, cv2.imencode(".jpg", crop_img)[1].tobytes()))
+    else:
+        crops_dir = config.OUTPUT_DIR / "crops"
+        for number, crop_img in enumerate(crops, start=1):
+            cv2.imwrite(str(crops_dir / f"{base}_change_{number}.jpg"), crop_img)
+
+    # --- STEP 9: SAVE FINAL COMPOSITE ---
+    output_path = config.OUTPUT_DIR / f"{base}~3_Final.jpg"
+    cv2.imwrite(str(output_path), detector.render(before, after_aligned, changes))
+    return output_path, encoded
+
+
+def process_pair(before_path: Path, config: Optional[Config] = None) -> PairResult:
+    """
+    Worker function for Multiprocessing: detect, save crops and the final composite.
+    Headless: detect only and return the detection record.
+    Failures come back as an "ERROR" result so one bad pair does not stop the batch.
+    """
+    config = config or Config()
+    base = before_path.stem
+    try:
+        after_path = before_path.parent / f"{base}~2.jpg"
+
+        if not after_path.exists():
+            return PairResult("WARNING", base, f"Missing after image for {base}")
+
+        start = time.perf_counter()
+        before = cv2.imread(str(before_path))
+        after = cv2.imread(str(after_path))
+
+        if before is None or after is None:
+            return PairResult("ERROR", base, f"Failed to read images for {base}")
+
+        detector = ChangeDetector(config)
+        read_seconds = time.perf_counter() - start
+        after_aligned, changes = detector.detect(before, after)
+        timings = {"read": read_seconds, **detector.timings}
+
+        if config.HEADLESS:
+            record = detection_record(base, before_path, after_path, before.shape, detector.alignment, timings, changes)
+            return PairResult("DETECTED", base, f"{base} (Detected: {len(changes)})", changes=len(changes),
+                              record=record)
+
+        start = time.perf_counter()
+        output_path, crops = save_outputs(detector, base, before, after_aligned, changes)
+        timings["render"] = time.perf_counter() - start
+
+        record = None
+        if config.RECORDS:
+            record = detection_record(base, before_path, after_path, before.shape, detector.alignment, timings, changes)
+        return PairResult("SAVED", base, f"{output_path} (Detected: {len(changes)})", changes=len(changes),
+                          record=record, crops=crops)
+    except Exception as e:
+        return PairResult("ERROR", base, f"Exception {base}: {e}")
+
+
+def render_record(record: dict, config: Optional[Config] = None) -> PairResult:
+    """
+    Worker function for replaying a detection record: re-applies the stored
+    homography (no feature matching, no detection) and saves crops + composite.
+    """
+    config = config or Config()
+    base = record["pair"]
+    try:
+        before = cv2.imread(record["before"])
+        after = cv2.imread(record["after"])
+
+        if before is None or after is None:
+            return PairResult("ERROR", base, f"Failed to read images for {base}")
+
+        detector = ChangeDetector(config)
+        alignment = record["alignment"]
+        after_aligned = detector.warp(before, after, alignment["homography"], alignment["mode"])
+        changes = record_regions(record)
+        output_path, crops = save_outputs(detector, base, before, after_aligned, changes)
+        return PairResult("SAVED", base, f"{output_path} (Detected: {len(changes)})", changes=len(changes),
+                          crops=crops)
+    except Exception as e:
+        return PairResult("ERROR", base, f"Exception {base}: {e}")
+
+# ----------------- DETECTION RECORDS -----------------
+def detection_record(base: str, before_path: Path, after_path: Path, shape, alignment: dict,
+                     timings: dict, changes: np.ndarray) -> dict:
+    """
+    JSON-ready record of one pair: source images, alignment, timings and regions.
+    """
+    regions = [dict(zip(REGION_DTYPE.names, row)) for row in changes.tolist()]
+    for region in regions:
+        region["size"] = SIZE_LABELS[region["size"]]
+    return {
+        "pair": base,
+        "before": str(before_path.resolve()),
+        "after": str(after_path.resolve()),
+        "width": shape[1],
+        "height": shape[0],
+        "alignment": alignment,
+        "timings": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "regions": regions,
+    }
+
+
+def record_regions(record: dict) -> np.ndarray:
+    """
+    REGION_DTYPE array back from a detection record.
+    """
+    regions = np.zeros(len(record["regions"]), dtype=REGION_DTYPE)
+    for name in REGION_DTYPE.names:
+        if name == "size":
+            regions[name] = [SIZE_LABELS.index(region["size"]) for region in record["regions"]]
+        else:
+            regions[name] = [region[name] for region in record["regions"]]
+    return regions
+
+
+def records_path(config: Config) -> Path:
+    return config.RECORDS_PATH or config.OUTPUT_DIR / f"detections.{config.RECORDS_FORMAT}"
+
+
+class RecordWriter:
+    """
+    One batched file per run. JSONL is streamed line by line as results
+    arrive; Parquet is written once on close().
+    """
+
+    def __init__(self, path: Path, fmt: str = "jsonl"):
+        if fmt not in ("jsonl", "parquet"):
+            raise ValueError(f"Unknown RECORDS_FORMAT: {fmt!r}")
+        if fmt == "parquet" and pq is None:
+            raise ImportError("Parquet records need pyarrow (pip install pyarrow), or use RECORDS_FORMAT='jsonl'")
+        self.path, self.fmt = path, fmt
+        self.count = 0
+        self._buffer: List[dict] = []
+        self._file = open(path, "w", encoding="utf-8") if fmt == "jsonl" else None
+
+    def write(self, record: dict) -> None:
+        self.count += 1
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+        else:
+            self._buffer.append(record)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        elif self._buffer:
+            pq.write_table(pa.Table.from_pylist(self._buffer), self.path)
+
+
+def load_records(path: Path) -> List[dict]:
+    """
+    Detection records from a .jsonl or .parquet file.
+    """
+    if path.suffix == ".parquet":
+        if pq is None:
+            raise ImportError("Reading Parquet records needs pyarrow (pip install pyarrow)")
+        return pq.read_table(path).to_pylist()
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# ----------------- CROP DATASET SHARDS -----------------
+class CropShardWriter:
+    """
+    Packs encoded crops into crops-NNNNNN.tar shards of at most max_bytes,
+    plus index.jsonl (shard, member, source pair, bbox, area, size class).
+    Writing runs on a background thread fed by a bounded queue, so it
+    overlaps with the workers' detection.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, queue_size: int = 64):
+        self.directory, self.max_bytes = directory, max_bytes
+        self.shards = 0
+        self.count = 0
+        self._tar: Optional[tarfile.TarFile] = None
+        self._shard_name = ""
+        self._shard_bytes = 0
+        self._error: Optional[BaseException] = None
+        self._index = open(directory / "index.jsonl", "w", encoding="utf-8")
+        self._queue: "queue.Queue[Optional[list]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="crop-shards", daemon=True)
+        self._thread.start()
+
+    def submit(self, crops: list) -> None:
+        self._queue.put(crops)
+
+    def _run(self) -> None:
+        while True:
+            crops = self._queue.get()
+            if crops is None:
+                return
+            if self._error is not None:
+                continue   # Keep draining so submit() never blocks
+            try:
+                for entry, data in crops:
+                    self._add(entry, data)
+            except Exception as e:
+                self._error = e
+
+    def _add(self, entry: dict, data: bytes) -> None:
+        # Tar header + payload padded to 512-byte blocks; closing pads up to one RECORDSIZE
+        member_bytes = 512 + -(-len(data) // 512) * 512
+        if self._tar is None or (self._shard_bytes and
+                                 self._shard_bytes + member_bytes + tarfile.RECORDSIZE > self.max_bytes):
+            self._roll()
+
+        member = f"{entry['pair']}_change_{entry['number']}.jpg"
+        info = tarfile.TarInfo(member)
+        info.size, info.mtime = len(data), int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        self._shard_bytes += member_bytes
+        self.count += 1
+        self._index.write(json.dumps({"shard": self._shard_name, "member": member, **entry}) + "\n")
+
+    def _roll(self) -> None:
+        if self._tar is not None:
+            self._tar.close()
+        self._shard_name = f"crops-{self.shards:06d}.tar"
+        self._tar = tarfile.open(self.directory / self._shard_name, "w")
+        self._shard_bytes = 0
+        self.shards += 1
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        if self._tar is not None:
+            self._tar.close()
+        self._index.close()
+        if self._error is not None:
+            raise self._error
+
+# ----------------- BATCH RUNNER -----------------
+def plan_execution(config: Config, n_pairs: int) -> Config:
+    """
+    Resolves the auto (0) worker / thread / chunk settings for n_pairs.
+    """
+    cpus = os.cpu_count() or 1
+    processes = config.MAX_WORKERS or max(1, min(cpus, n_pairs))
+    cv_threads = config.CV_THREADS or max(1, cpus // processes)
+    chunksize = config.CHUNKSIZE or max(1, min(16, n_pairs // (processes * 4)))
+    return replace(config, MAX_WORKERS=processes, CV_THREADS=cv_threads, CHUNKSIZE=chunksize)
+
+
+def find_pairs(input_dir: Path) -> List[Path]:
+    """
+    Before images (name.jpg) of all pairs; the after image is name~2.jpg.
+    """
+    return sorted(path for path in input_dir.glob("*.jpg") if "~2" not in path.name)
+
+
+def run_batch(items: list, config: Config, worker=process_pair, records: Optional[RecordWriter] = None,
+              shards: Optional[CropShardWriter] = None) -> List[PairResult]:
+    """
+    Runs all items (before paths, or records for render_record) through a
+    process pool (results in input order). Detection records go to
+    `records`, encoded crops to `shards`.
+    """
+    config = plan_execution(config, len(items))
+    results = []
+    with ProcessPoolExecutor(max_workers=config.MAX_WORKERS, initializer=init_worker,
+                             initargs=(config.CV_THREADS,)) as executor:
+        for res in executor.map(partial(worker, config=config), items, chunksize=config.CHUNKSIZE):
+            print(res)
+            if records is not None and res.record is not None:
+                records.write(res.record)
+            if shards is not None and res.crops:
+                shards.submit(res.crops)
+            res.crops = None
+            results.append(res)
+    return results
+
+# ----------------- MAIN PROCESSING -----------------
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Before / after change detection")
+    parser.add_argument("--input-dir", type=Path, help="Override Config.INPUT_DIR")
+    parser.add_argument("--output-dir", type=Path, help="Override Config.OUTPUT_DIR")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int, help="Pairs handed to a worker at a time")
+    parser.add_argument("--align-mode", choices=["full", "pyramid"], help="Override Config.ALIGN_MODE")
+    parser.add_argument("--align-max-side", type=int, help="Override Config.ALIGN_MAX_SIDE")
+    parser.add_argument("--regions", choices=["contours", "components"], help="Override Config.REGION_METHOD")
+    parser.add_argument("--matcher", choices=["bruteforce", "ratio", "flann"], help="Override Config.MATCHER")
+    parser.add_argument("--feature-cache-dir", type=Path, help="Override Config.FEATURE_CACHE_DIR")
+    parser.add_argument("--no-feature-cache", action="store_true", help="Always recompute reference features")
+    parser.add_argument("--headless", action="store_true", help="Detect only: write records, no composites or crops")
+    parser.add_argument("--records", type=Path, help="Also write detection records to this .jsonl / .parquet file")
+    parser.add_argument("--crop-format", choices=["files", "tar"], help="Override Config.CROP_FORMAT")
+    parser.add_argument("--shard-mb", type=int, help="Override Config.CROP_SHARD_MB")
+    parser.add_argument("--render-records", type=Path, help="Render composites and crops from a records file, then exit")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    cfg = Config()
+    if args.input_dir:
+        cfg = replace(cfg, INPUT_DIR=args.input_dir)
+    if args.output_dir:
+        cfg = replace(cfg, OUTPUT_DIR=args.output_dir)
+    if args.workers:
+        cfg = replace(cfg, MAX_WORKERS=args.workers)
+    if args.chunksize:
+        cfg = replace(cfg, CHUNKSIZE=args.chunksize)
+    if args.align_mode:
+        cfg = replace(cfg, ALIGN_MODE=args.align_mode)
+    if args.align_max_side:
+        cfg = replace(cfg, ALIGN_MAX_SIDE=args.align_max_side)
+    if args.regions:
+        cfg = replace(cfg, REGION_METHOD=args.regions)
+    if args.matcher:
+        cfg = replace(cfg, MATCHER=args.matcher)
+    if args.feature_cache_dir:
+        cfg = replace(cfg, FEATURE_CACHE_DIR=args.feature_cache_dir)
+    if args.no_feature_cache:
+        cfg = replace(cfg, FEATURE_CACHE=False)
+    if args.headless:
+        cfg = replace(cfg, HEADLESS=True)
+    if args.crop_format:
+        cfg = replace(cfg, CROP_FORMAT=args.crop_format)
+    if args.shard_mb:
+        cfg = replace(cfg, CROP_SHARD_MB=args.shard_mb)
+    if args.records:
+        cfg = replace(cfg, RECORDS=True, RECORDS_PATH=args.records,
+                      RECORDS_FORMAT="parquet" if args.records.suffix == ".parquet" else "jsonl")
+
+    # Create main output folder and sub-folder for cropped changes (Dataset Creation)
+    crops_dir = cfg.OUTPUT_DIR / "crops"
+    (cfg.OUTPUT_DIR if cfg.HEADLESS else crops_dir).mkdir(parents=True, exist_ok=True)
+
+    writer = None
+    if args.render_records:
+        items, worker = load_records(args.render_records), render_record
+        label = f"[RENDERING] {len(items)} record(s) from {args.render_records}"
+    else:
+        items, worker = find_pairs(cfg.INPUT_DIR), process_pair
+        label = f"[PROCESSING] {len(items)} pair(s)"
+        if cfg.HEADLESS or cfg.RECORDS:
+            writer = RecordWriter(records_path(cfg), cfg.RECORDS_FORMAT)
+    shards = None
+    if cfg.CROP_FORMAT == "tar" and not cfg.HEADLESS:
+        shards = CropShardWriter(crops_dir, cfg.CROP_SHARD_MB * 1024 * 1024)
+    plan = plan_execution(cfg, len(items))
+    print(f"{label} on {plan.MAX_WORKERS} process(es), chunksize {plan.CHUNKSIZE}")
 
-        output_path = os.path.join(output_dir, base + "~3_Final.jpg")
-        cv2.imwrite(output_path, combined)
-        print(f"[SAVED] {output_path} (Detected: {change_count})")
+    try:
+        results = run_batch(items, cfg, worker, records=writer, shards=shards)
+    finally:
+        if writer is not None:
+            writer.close()
+        if shards is not None:
+            shards.close()
 
-print("\n--- PROCESS COMPLETE ---")
-print(f"Crops saved in: {crops_dir}")
\ No newline at end of file
+    done = ("SAVED", "DETECTED")
+    print("\n--- PROCESS COMPLETE ---")
+    print(f"Pairs: {sum(res.status in done for res in results)} {'detected' if cfg.HEADLESS else 'saved'}, "
+          f"{sum(res.status not in done for res in results)} skipped "
+          f"({sum(res.status == 'ERROR' for res in results)} error(s)). "
+          f"Changes: {sum(res.changes for res in results)}")
+    if writer is not None:
+        print(f"Records ({writer.count}) saved in: {writer.path}")
+    if shards is not None:
+        print(f"Crops ({shards.count} in {shards.shards} shard(s)) saved in: {crops_dir}")
+    elif not cfg.HEADLESS:
+        print(f"Crops saved in: {crops_dir}")